@@ -0,0 +1,60 @@
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from api_utils import build_apparts_df
+from processing_utils import cleaner
+from bench_listing_assembly import ADS_PER_PAGE, synthetic_page
+
+
+def legacy_metro_extractor(metro_ls):
+    stops_names = [x['name'] for x in metro_ls]
+    lines_names = [x['lines'] for x in metro_ls]
+    lines_names = set(itertools.chain.from_iterable(lines_names))
+    return [stops_names, lines_names]
+
+
+def legacy_cleaner(df, columns=['source_logo', 'source_label', 'search_type',
+ 'rent_max', 'bedroom', 'buy_type', 'new_real_estate', 'webview_link', 'source_description']):
+    # Reproduction de l'ancien cleaner : apply par ligne, json_normalize puis merge sur l'id
+    df['features'] = df['features'].apply(lambda x: {} if pd.isna(x) else x)
+    df_extract = pd.json_normalize(df['features'])
+    df = df.merge(df_extract, how='left', on='id')
+
+    metro_res = df['stops'].apply(lambda x: legacy_metro_extractor(x))
+    df[['metro_stations', 'metro_lines']] = pd.DataFrame(metro_res.tolist(), index=df.index)
+
+    columns_to_drop = columns + ['year', 'box', 'stops', 'features']
+    df = df.drop(columns=columns_to_drop)
+    return df
+
+
+def measure(func, df):
+    start = time.perf_counter()
+    df_clean = func(df.copy())
+    return time.perf_counter() - start, df_clean
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the legacy and batched cleaner.')
+    parser.add_argument('--ads', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"{'ads':>7} | {'legacy s':>9} {'legacy MiB':>10} | {'batched s':>9} {'batched MiB':>11}")
+    for nb_ads in args.ads:
+        records = [ad for page in range(1, nb_ads // ADS_PER_PAGE + 2) for ad in synthetic_page(page)][:nb_ads]
+        df = build_apparts_df(records).set_index('id')
+        legacy_time, df_legacy = measure(legacy_cleaner, df)
+        batched_time, df_batched = measure(cleaner, df)
+        legacy_memory = df_legacy[['metro_stations', 'metro_lines']].memory_usage(deep=True).sum() / 1024 ** 2
+        batched_memory = df_batched[['metro_stations', 'metro_lines']].memory_usage(deep=True).sum() / 1024 ** 2
+        print(f'{nb_ads:>7} | {legacy_time:>9.3f} {legacy_memory:>10.1f} | {batched_time:>9.3f} {batched_memory:>11.1f}')
+    print('MiB : memory used by the metro_stations and metro_lines columns.')
@@ -0,0 +1,52 @@
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from api_utils import apply_schema, build_apparts_df
+from export_utils import export_apparts
+from processing_utils import cleaner, features_engineering
+from bench_listing_assembly import ADS_PER_PAGE, synthetic_page
+
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+
+def legacy_export(df, csv_path, xlsx_path):
+    # Reproduction de l'ancien export : un premier to_excel échoue sur les caractères interdits, puis tout est réécrit
+    from openpyxl.utils.exceptions import IllegalCharacterError
+
+    df.to_csv(csv_path, sep=';', encoding='utf-8')
+    try:
+        df.to_excel(xlsx_path)
+    except IllegalCharacterError:
+        df.map(lambda x: ILLEGAL_CHARACTERS_RE.sub(r'', x) if isinstance(x, str) else x).to_excel(xlsx_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the legacy and streaming export of the apparts.')
+    parser.add_argument('--ads', type=int, default=10000)
+    parser.add_argument('--illegal', action='store_true', help='Put an illegal character in the last description.')
+    args = parser.parse_args()
+
+    random.seed(0)
+    records = [ad for page in range(1, args.ads // ADS_PER_PAGE + 2) for ad in synthetic_page(page)][:args.ads]
+    if args.illegal:
+        records[-1]['description'] += '\x03'
+    df = features_engineering(cleaner(apply_schema(build_apparts_df(records).set_index('id'))))
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'apparts.csv')
+        xlsx_path = os.path.join(directory, 'apparts.xlsx')
+        start = time.perf_counter()
+        legacy_export(df, csv_path, xlsx_path)
+        legacy_time = time.perf_counter() - start
+        start = time.perf_counter()
+        export_apparts(df, csv_path, xlsx_path)
+        streaming_time = time.perf_counter() - start
+
+    print(f'{len(df)} ads: legacy {legacy_time:.2f}s, streaming {streaming_time:.2f}s')
@@ -0,0 +1,72 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from api_utils import apply_schema, build_apparts_df
+from processing_utils import content_hashes, nested_hash, post_processing
+from storage_utils import FeatureCache
+from bench_listing_assembly import ADS_PER_PAGE, synthetic_page
+
+
+def measure(func, *func_args):
+    start = time.perf_counter()
+    result = func(*func_args)
+    return time.perf_counter() - start, result
+
+
+def hash_ads(records):
+    # Comme get_apparts_page à la lecture de chaque page
+    for ad in records:
+        ad['nested_hash'] = nested_hash(ad)
+
+
+def change_rents(df, share):
+    # Une part des annonces change de loyer et de coordonnées, comme une annonce republiée
+    df = df.copy()
+    changed = df.index[:max(1, int(len(df) * share))]
+    df.loc[changed, 'lat'] = df.loc[changed, 'lat'] + 0.001
+    df.loc[changed, 'rent'] = df.loc[changed, 'rent'] - 50
+    return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the post-processing of every appart with the feature cache '
+                                                 'keyed by a content hash of the raw fields, in a full synchronisation.')
+    parser.add_argument('--ads', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--churn', type=float, default=0.05, help='Share of new or changed apparts in a run.')
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"{'ads':>7} | {'no cache s':>10} | {'fetch hash s':>12} | {'hash s':>7} | {'cold cache s':>12} | "
+          f"{'warm cache s':>12} | same")
+    for nb_ads in args.ads:
+        records = [ad for page in range(1, nb_ads // ADS_PER_PAGE + 2) for ad in synthetic_page(page)][:nb_ads]
+        fetch_hash_time, _ = measure(hash_ads, records)
+        df = apply_schema(build_apparts_df(records).set_index('id'))
+        nb_churn = max(1, int(nb_ads * args.churn))
+        # Exécution suivante : les nouvelles annonces remplacent les plus anciennes, d'autres changent de loyer
+        df_next = change_rents(pd.concat([df.iloc[-nb_churn:], df.iloc[:-nb_churn]]), args.churn)
+        df_next = df_next.rename(index=dict(zip(df_next.index[:nb_churn], df_next.index[:nb_churn] + 10 ** 9)))
+        with tempfile.TemporaryDirectory() as directory:
+            feature_cache = FeatureCache(os.path.join(directory, 'features.db'))
+            no_cache_time, df_expected = measure(post_processing, df_next.copy())
+            hash_time, _ = measure(content_hashes, df_next)
+            cold_time, _ = measure(post_processing, df.copy(), feature_cache)
+            warm_time, df_cached = measure(post_processing, df_next.copy(), feature_cache)
+            feature_cache.close()
+        same = df_cached.equals(df_expected) and (df_cached.dtypes == df_expected.dtypes).all()
+        print(f'{nb_ads:>7} | {no_cache_time:>10.3f} | {fetch_hash_time:>12.3f} | {hash_time:>7.3f} | '
+              f'{cold_time:>12.3f} | {warm_time:>12.3f} | {same}')
+    print('no cache : cleaner and features_engineering on every appart.')
+    print('fetch hash : hash of the nested fields of every raw ad, done while the pages are read.')
+    print('hash : content hash of the scalar fields combined with the nested hash. cold cache : first run, every '
+          'appart computed and saved.')
+    print('warm cache : next run, with the given share of new apparts and of changed rents and coordinates.')
+    print('same : the cached result is identical to the one computed without cache, dtypes included.')
@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from api_utils import APPARTS_COLUMNS, build_apparts_df
+
+ADS_PER_PAGE = 24
+STOPS = [{'name': 'Bastille', 'lines': ['1', '5', '8']}, {'name': 'Nation', 'lines': ['1', '2', '6', '9', 'RER A']},
+         {'name': 'Oberkampf', 'lines': ['5', '9']}, {'name': 'Voltaire', 'lines': ['9']},
+         {'name': 'Gare de Lyon', 'lines': ['1', '14', 'RER A', 'RER D']}]
+
+
+def synthetic_page(page, alert_id='bench-alert', first_id=0):
+    ads = []
+    for i in range(ADS_PER_PAGE):
+        ad_id = first_id + page * ADS_PER_PAGE + i
+        ads.append({
+            'id': ad_id, 'source': random.choice(['pap', 'seloger', 'leboncoin', 'orpi']),
+            'owner_type': random.choice(['Agence', 'Particulier']), 'rent': random.randint(600, 3000),
+            'area': random.randint(10, 120), 'room': random.randint(1, 5), 'floor': random.randint(0, 8),
+            'type': 'Appartement', 'city': 'Paris', 'postal_code': f'750{random.randint(1, 20):02d}',
+            'lat': 48.85 + random.random() / 10, 'lng': 2.35 + random.random() / 10, 'furnished': random.random() > 0.5,
+            'description': 'Bel appartement lumineux. ' * 20, 'images': [f'https://img/{ad_id}/{k}.jpg' for k in range(8)],
+            'created_at': '2021-03-01T10:00:00.000Z', 'expired_at': None, 'sendDate': '2021-03-01T10:00:00.000Z',
+            'previous_rent': None, 'source_description': 'Annonce', 'alert_id': alert_id, 'page': page,
+            'stops': random.sample(STOPS, random.randint(0, 3)),
+            'features': {'balcony': random.random() > 0.5, 'lift': random.random() > 0.5, 'year': 1900, 'box': None},
+        })
+    return ads
+
+
+def legacy_assembly(pages):
+    # Reproduction de l'ancien get_apparts : concaténation sur un DataFrame qui grossit à chaque page
+    df_apparts = pd.DataFrame(columns=APPARTS_COLUMNS)
+    for ads in pages:
+        df_apparts = pd.concat([df_apparts, pd.DataFrame.from_records(data=ads)], ignore_index=True)
+    return df_apparts
+
+
+def accumulator_assembly(pages):
+    records = []
+    for ads in pages:
+        records.extend(ads)
+    return build_apparts_df(records)
+
+
+def measure(func, pages):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(pages)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024 ** 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the legacy and streaming assembly of ad listings.')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 50, 100, 200, 400])
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"{'pages':>6} {'ads':>7} | {'legacy s':>9} {'legacy MiB':>10} | {'stream s':>9} {'stream MiB':>10}")
+    for nb_pages in args.pages:
+        pages = [synthetic_page(page) for page in range(1, nb_pages + 1)]
+        legacy_time, legacy_peak = measure(legacy_assembly, pages)
+        stream_time, stream_peak = measure(accumulator_assembly, pages)
+        print(f'{nb_pages:>6} {nb_pages * ADS_PER_PAGE:>7} | {legacy_time:>9.3f} {legacy_peak:>10.1f} | '
+              f'{stream_time:>9.3f} {stream_peak:>10.1f}')
@@ -0,0 +1,99 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import logzero
+import pandas as pd
+
+from mock_jinka import MockJinka, start_server
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+
+def import_main(root, workdir, cli_args):
+    # main calcule ses chemins à l'import : le dossier de travail est choisi avant
+    os.environ['KAJIN_API_ROOT'] = root
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.abspath(SRC_PATH))
+    import api_utils
+    import main
+    main.parse_args(['-e', 'bench@kajin.local', '-p', 'bench'] + cli_args)
+    main.setup()
+    # api_utils a pu être importé avant que le port du serveur soit connu
+    api_utils.API_ROOT = root
+    main.upload = False
+    return main
+
+
+def run_once(main, expired, state=None):
+    start = time.perf_counter()
+    main.run_all('bench@kajin.local', 'bench', expired=expired, state=state)
+    wall_time = time.perf_counter() - start
+    with open(main.RUN_REPORT_PATH, 'r') as f:
+        run_report = json.load(f)
+    nb_ads = len(pd.read_csv(main.APPARTS_CSV_PATH, sep=';', usecols=['id']))
+    return {'ads': nb_ads, 'wall_time': round(wall_time, 3), 'ads_per_second': round(nb_ads / wall_time, 1),
+            'totals': run_report['totals'], 'stages': run_report['stages']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run run_all end-to-end against a local mock of the Jinka API.')
+    parser.add_argument('--alerts', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds added to every mock response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500.')
+    parser.add_argument('--expired-rate', type=float, default=0.0, help='Share of ads flagged as expired by Jinka.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='Share of requests answered with a 429 and a Retry-After header.')
+    parser.add_argument('--token-lifetime', type=int, default=0,
+                        help='Number of API requests accepted with a same token, 0 for no expiration.')
+    parser.add_argument('--workers', type=int, default=8, help='Requests in flight, given to main.py.')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Requests per second, 0 for no limit.')
+    parser.add_argument('--runs', type=int, default=2, help='Consecutive runs, the next ones reuse the databases.')
+    parser.add_argument('--expired', action='store_true', help='Check and remove expired offers.')
+    parser.add_argument('--warm', action='store_true',
+                        help='Keep the session, caches and indexes between runs, like the daemon mode of main.py.')
+    parser.add_argument('--report', help='Path of a JSON report.')
+    parser.add_argument('main_args', nargs=argparse.REMAINDER, help='Extra arguments given to main.py, after --.')
+    args = parser.parse_args()
+
+    report_path = os.path.abspath(args.report) if args.report else None
+    mock = MockJinka(args.alerts, args.pages, args.latency, args.error_rate, args.expired_rate,
+                     throttle_rate=args.throttle_rate, token_lifetime=args.token_lifetime)
+    server, root = start_server(mock)
+    workdir = tempfile.mkdtemp(prefix='kajin-bench-')
+    main_args = args.main_args[1:] if args.main_args[:1] == ['--'] else args.main_args
+    cli_args = ['-w', str(args.workers), '-r', str(args.rate_limit)] + main_args
+    main = import_main(root, workdir, cli_args)
+    logzero.loglevel(logging.WARNING)
+
+    state = main.PipelineState(warm=True) if args.warm else None
+    runs = []
+    for run in range(args.runs):
+        requests_before = mock.requests
+        result = run_once(main, args.expired, state)
+        result['requests'] = mock.requests - requests_before
+        runs.append(result)
+    if state is not None:
+        state.close()
+    server.shutdown()
+
+    report = {'alerts': args.alerts, 'pages': args.pages, 'latency': args.latency, 'error_rate': args.error_rate,
+              'throttle_rate': args.throttle_rate, 'token_lifetime': args.token_lifetime, 'warm': args.warm,
+              'runs': runs, 'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    for run, result in enumerate(runs, start=1):
+        print(f"\nRun {run}: {result['ads']} ads in {result['wall_time']:.2f}s "
+              f"({result['ads_per_second']} ads/s, {result['requests']} requests received by the mock)")
+        print(f"  {'stage':<22} {'time':>9} {'rows':>7} {'requests':>9} {'KiB':>9} {'retries':>8} {'cache hits':>11}")
+        for stage in result['stages']:
+            print(f"  {stage['name']:<22} {stage['wall_time']:>8.3f}s {stage['rows'] or 0:>7} {stage['requests']:>9} "
+                  f"{stage['bytes'] / 1024:>9.1f} {stage['retries']:>8} {stage['cache_hits']:>11}")
+    print(f"\nPeak RSS: {report['peak_rss_mib']} MiB")
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
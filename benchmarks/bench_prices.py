@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from storage_utils import PriceStore
+from price_utils import price_drops, rent_trend, time_on_market
+
+
+def daily_snapshots(nb_apparts, days, churn, change_rate, seed=0):
+    # Annonces en ligne chaque jour : une part est remplacée, quelques loyers changent (surtout à la baisse)
+    rng = np.random.default_rng(seed)
+    ids = np.arange(nb_apparts)
+    rents = rng.integers(600, 3000, nb_apparts).astype(float)
+    next_id = nb_apparts
+    start = pd.Timestamp('2023-01-01')
+    for day in range(days):
+        replaced = rng.random(len(ids)) < churn
+        ids[replaced] = np.arange(next_id, next_id + replaced.sum())
+        rents[replaced] = rng.integers(600, 3000, replaced.sum())
+        next_id += replaced.sum()
+        changed = rng.random(len(ids)) < change_rate
+        rents[changed] = np.round(rents[changed] * rng.choice([0.95, 0.97, 1.02], changed.sum()))
+        yield start + pd.Timedelta(days=day), pd.DataFrame({'rent': rents.copy()}, index=ids.copy()), next_id
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record daily snapshots of rents in the price time series, then time '
+                                                 'the price drops, time on market and rent trend queries.')
+    parser.add_argument('--apparts', type=int, default=5000, help='Apparts online on a given day.')
+    parser.add_argument('--days', type=int, default=3 * 365)
+    parser.add_argument('--churn', type=float, default=0.03, help='Share of the apparts replaced every day.')
+    parser.add_argument('--change-rate', type=float, default=0.005, help='Share of the rents changing every day.')
+    parser.add_argument('--postal-codes', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, 'prices.db')
+        store = PriceStore(db_path)
+        store.warm_index()
+        record_times = []
+        for observed_at, df_snapshot, nb_seen in daily_snapshots(args.apparts, args.days, args.churn,
+                                                                 args.change_rate):
+            start = time.perf_counter()
+            store.record(df_snapshot, observed_at=observed_at)
+            record_times.append(time.perf_counter() - start)
+        nb_rows = store.count()
+        print(f'{args.days} daily snapshots of {args.apparts} apparts, {nb_seen} apparts seen')
+        print(f'observations stored: {nb_rows} instead of {args.days * args.apparts} for full snapshots '
+              f'({os.path.getsize(db_path) / 1024 ** 2:.1f} MiB)')
+        print(f'record: {np.median(record_times) * 1000:.1f} ms median per snapshot, '
+              f'{np.max(record_times) * 1000:.1f} ms max, {np.sum(record_times):.1f} s in total')
+
+        now = observed_at + pd.Timedelta(days=1)
+        postal_codes = pd.Series(np.arange(nb_seen) % args.postal_codes + 75001, index=np.arange(nb_seen).astype(str))
+        queries = {
+            'load': lambda: store.load(),
+            'price drops': lambda: price_drops(df_prices),
+            'time on market': lambda: time_on_market(df_prices, now=now),
+            'monthly rent trend': lambda: rent_trend(df_prices, postal_codes, now=now),
+        }
+        for name, query in queries.items():
+            start = time.perf_counter()
+            result = query()
+            if name == 'load':
+                df_prices = result
+            print(f'{name:<20} {time.perf_counter() - start:>7.3f} s  {len(result)} rows')
@@ -0,0 +1,32 @@
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from api_utils import HEAVY_COLUMNS, apply_schema, build_apparts_df
+from bench_listing_assembly import ADS_PER_PAGE, synthetic_page
+
+
+def memory_mib(df):
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory used by the ad listings with and without the typed schema.')
+    parser.add_argument('--ads', type=int, default=100000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    records = [ad for page in range(1, args.ads // ADS_PER_PAGE + 2) for ad in synthetic_page(page)][:args.ads]
+    # Ancien comportement : le DataFrame vide de départ rendait toutes les colonnes de type object
+    df_untyped = build_apparts_df(records).set_index('id').astype(object)
+    df_typed = apply_schema(build_apparts_df(records).set_index('id'))
+    df_light = apply_schema(build_apparts_df(records, exclude=HEAVY_COLUMNS).set_index('id'))
+
+    untyped = memory_mib(df_untyped)
+    print(f'{len(records)} ads')
+    print(f"{'object columns':<30} {untyped:>9.1f} MiB")
+    for name, df in [('typed schema', df_typed), ('typed schema, light', df_light)]:
+        print(f'{name:<30} {memory_mib(df):>9.1f} MiB  ({memory_mib(df) / untyped:.0%})')
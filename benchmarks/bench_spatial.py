@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from geo_utils import haversine, spatial_features
+
+
+def synthetic_apparts(nb_apparts, seed=0):
+    # Annonces réparties sur Paris et sa petite couronne
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'lat': 48.80 + rng.random(nb_apparts) * 0.12, 'lng': 2.25 + rng.random(nb_apparts) * 0.20,
+                         'price_m2': rng.normal(30, 8, nb_apparts)})
+
+
+def per_row_features(df, pois, radius, k):
+    # Ce qu'il faudrait écrire sans index : une passe complète sur toutes les annonces pour chaque annonce
+    lat, lng, price_m2 = df['lat'].to_numpy(), df['lng'].to_numpy(), df['price_m2'].to_numpy()
+    rows = []
+    for i in range(len(df)):
+        distances = haversine(lat[i], lng[i], lat, lng)
+        distances[i] = np.inf
+        close = np.flatnonzero(distances <= radius)
+        nearest = close[np.argsort(distances[close])[:k]]
+        rows.append({**{f'distance_{name}': haversine(lat[i], lng[i], *coords) for name, coords in pois.items()},
+                     'neighbours': len(close), 'neighbours_price_m2': price_m2[nearest].mean() if len(nearest) else None})
+    return pd.DataFrame(rows, index=df.index)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the grid index with a per-row scan of every appart.')
+    parser.add_argument('--apparts', type=int, nargs='+', default=[1000, 5000, 20000])
+    parser.add_argument('--radius', type=int, default=500)
+    parser.add_argument('--neighbours', type=int, default=5)
+    args = parser.parse_args()
+
+    pois = {'work': (48.8698, 2.3075), 'station': (48.8443, 2.3744)}
+    print(f"{'apparts':>8} | {'per row s':>10} | {'grid s':>8} | {'speed-up':>8}")
+    for nb_apparts in args.apparts:
+        df = synthetic_apparts(nb_apparts)
+        start = time.perf_counter()
+        per_row_features(df, pois, args.radius, args.neighbours)
+        per_row_time = time.perf_counter() - start
+        start = time.perf_counter()
+        spatial_features(df.copy(), pois=pois, radius=args.radius, k=args.neighbours)
+        grid_time = time.perf_counter() - start
+        print(f'{nb_apparts:>8} | {per_row_time:>10.3f} | {grid_time:>8.3f} | {per_row_time / grid_time:>7.0f}x')
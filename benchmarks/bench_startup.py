@@ -0,0 +1,64 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+# Ce que chaque scénario importe avant de commencer à travailler
+SCENARIOS = {
+    'entry point (main.py -h, GUI window)': 'import main',
+    'CLI run': 'import main, api_utils, processing_utils, storage_utils, http_utils, metrics_utils, export_utils',
+    'CLI run with XLSX export': 'import main, api_utils, processing_utils, storage_utils, http_utils, metrics_utils, '
+                                'export_utils, openpyxl',
+    'previous entry point': 'import main, api_utils, processing_utils, storage_utils, http_utils, metrics_utils, '
+                            'export_utils, daemon_utils, openpyxl, PySimpleGUI',
+}
+WATCHED_MODULES = ['pandas', 'numpy', 'requests', 'openpyxl', 'PySimpleGUI', 'tkinter', 'bs4']
+
+
+def import_times(statement):
+    # -X importtime écrit sur stderr une ligne par module : temps propre | temps cumulé | nom
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=SRC_PATH,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    total = 0.0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        loaded.add(name.strip())
+        # Seuls les modules de premier niveau sont additionnés, leur temps cumulé inclut leurs dépendances
+        if not name.startswith('  '):
+            total += int(cumulative) / 1000
+    return total, loaded
+
+
+def wall_time(statement):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', statement], cwd=SRC_PATH, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the cold start of main.py with python -X importtime.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each scenario, the median is reported.')
+    args = parser.parse_args()
+
+    baseline = statistics.median(wall_time('pass') for _ in range(args.repeat))
+    print(f'Interpreter start: {baseline * 1000:.0f} ms\n')
+    print(f"{'scenario':<40} {'imports ms':>10} {'wall ms':>8}  heavy modules loaded")
+    for scenario, statement in SCENARIOS.items():
+        try:
+            runs = [import_times(statement) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f'{scenario:<40} skipped: {e}')
+            continue
+        total = statistics.median(run[0] for run in runs)
+        wall = statistics.median(wall_time(statement) for _ in range(args.repeat))
+        loaded = [module for module in WATCHED_MODULES if module in runs[0][1]]
+        print(f"{scenario:<40} {total:>10.0f} {wall * 1000:>8.0f}  {', '.join(loaded) or '-'}")
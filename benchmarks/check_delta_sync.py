@@ -0,0 +1,107 @@
+import argparse
+import logging
+import shutil
+import sys
+import tempfile
+
+import logzero
+import pandas as pd
+
+from bench_listing_assembly import ADS_PER_PAGE
+from bench_pipeline import import_main, run_once
+from mock_jinka import MockJinka, start_server
+
+
+def exported_ids(main):
+    return set(pd.read_csv(main.APPARTS_CSV_PATH, sep=';', usecols=['id'])['id'].astype(str))
+
+
+def exported_value(main, appart_id, column):
+    df = pd.read_csv(main.APPARTS_CSV_PATH, sep=';', index_col='id')
+    df.index = df.index.astype(str)
+    return df.loc[str(appart_id), column]
+
+
+def check_value(name, main, appart_id, column, expected, failures):
+    value = exported_value(main, appart_id, column)
+    if value == expected:
+        print(f'ok    {name}: {column} {value}')
+    else:
+        print(f'FAIL  {name}: {column} {value} instead of {expected}')
+        failures.append(name)
+
+
+def check(name, main, expected_ids, failures):
+    ids = exported_ids(main)
+    if ids == expected_ids:
+        print(f'ok    {name}: {len(ids)} apparts')
+    else:
+        print(f'FAIL  {name}: {len(ids)} apparts instead of {len(expected_ids)}, '
+              f'{len(ids - expected_ids)} unexpected, {len(expected_ids - ids)} missing')
+        failures.append(name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check that the delta mode only keeps the apparts still online: an '
+                                                 'alert deleted on Jinka or an appart gone from its pages must not '
+                                                 'come back from the history.')
+    parser.add_argument('--alerts', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=4)
+    args = parser.parse_args()
+
+    mock = MockJinka(args.alerts, args.pages)
+    server, root = start_server(mock)
+    workdir = tempfile.mkdtemp(prefix='kajin-check-')
+    delta_args = ['-d', '-n', '--no-xlsx']
+    main = import_main(root, workdir, delta_args)
+    logzero.loglevel(logging.WARNING)
+
+    def online_ids():
+        return {str(ad['id']) for ads in mock.ads.values() for ad in ads}
+
+    failures = []
+    try:
+        run_once(main, expired=False)
+        check('first run, full synchronisation', main, online_ids(), failures)
+
+        # Alerte supprimée côté Jinka : ses annonces ne sont plus reprises de l'historique
+        mock.remove_alert('alert1')
+        run_once(main, expired=False)
+        check('delta run after an alert was deleted', main, online_ids(), failures)
+
+        # Annonces retirées d'une page que le mode delta ne relit pas : seule une synchronisation complète le voit
+        gone = [ad['id'] for ad in mock.ads[('alert0', args.pages)][:ADS_PER_PAGE // 2]]
+        mock.remove_ads(gone)
+        main.parse_args(['-e', 'bench@kajin.local', '-p', 'bench', '-f'] + delta_args)
+        run_once(main, expired=False)
+        check('forced full synchronisation after apparts were removed', main, online_ids(), failures)
+
+        main.parse_args(['-e', 'bench@kajin.local', '-p', 'bench'] + delta_args)
+        run_once(main, expired=False)
+        check('delta run after the full synchronisation', main, online_ids(), failures)
+
+        # Comme le daemon : état gardé entre les exécutions, une exécution sans nouvelle annonce peut garder ses exports
+        state = main.PipelineState(warm=True)
+        run_once(main, expired=False, state=state)
+        first_page = [ad['id'] for ad in mock.ads[('alert0', 1)]]
+        run_once(main, expired=False, state=state)
+        check('warm delta run without any change', main, online_ids(), failures)
+
+        mock.update_ads(first_page[:1], rent=123)
+        run_once(main, expired=False, state=state)
+        check_value('warm delta run after a rent change', main, first_page[0], 'rent', 123, failures)
+
+        mock.update_ads(first_page[1:2], expired_at='2021-03-02T10:00:00.000Z')
+        run_once(main, expired=False, state=state)
+        check_value('warm delta run after an expiration on Jinka', main, first_page[1], 'expired_at',
+                    '2021-03-02 10:00:00', failures)
+        if state.history_store.expired_ids(first_page[1:2]) == {str(first_page[1])}:
+            print('ok    expiration written to the history')
+        else:
+            print('FAIL  expiration written to the history')
+            failures.append('expiration written to the history')
+        state.close()
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,49 @@
+import logging
+import os
+import sys
+
+import logzero
+
+from mock_jinka import MockJinka, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def check(name, passed, detail, failures):
+    print(f"{'ok  ' if passed else 'FAIL'}  {name}: {detail}")
+    if not passed:
+        failures.append(name)
+
+
+if __name__ == '__main__':
+    # Un 401 du site d'une annonce ne doit pas reconnecter le compte à Jinka, un 401 de l'API si
+    mock = MockJinka(nb_alerts=1, nb_pages=1)
+    server, root = start_server(mock)
+    os.environ['KAJIN_API_ROOT'] = root
+    import api_utils
+    api_utils.API_ROOT = root
+    logzero.loglevel(logging.WARNING)
+
+    failures = []
+    try:
+        session = api_utils.authenticate('check@kajin.local', 'check')
+        ads = mock.ads[('alert0', 1)]
+        mock.unauthorized_listings.add(str(ads[0]['id']))
+
+        page = api_utils.get_appart_response(session, (ads[0]['id'], {'alert_id': 'alert0'}))
+        check('listing answering 401', page is None and mock.tokens == 1,
+              f'{mock.tokens - 1} login(s) after the first one', failures)
+
+        page = api_utils.get_appart_response(session, (ads[1]['id'], {'alert_id': 'alert0'}))
+        check('listing answering 200', page is not None and mock.tokens == 1,
+              page.url if page is not None else 'no page', failures)
+
+        # Jeton accepté une seule fois : la requête suivante à l'API reçoit un 401 et le jeton est renouvelé
+        mock.token_lifetime = 1
+        statuses = [session.get(root + '/apiv2/alert').status_code for _ in range(2)]
+        check('API answering 401', statuses == [200, 200] and mock.tokens == 2,
+              f'statuses {statuses}, {mock.tokens - 1} login(s) after the first one', failures)
+        session.close()
+    finally:
+        server.shutdown()
+    sys.exit(1 if failures else 0)
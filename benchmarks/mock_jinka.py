@@ -0,0 +1,225 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench_listing_assembly import ADS_PER_PAGE, synthetic_page
+
+SOURCES = ['pap', 'seloger', 'leboncoin', 'orpi', 'logic-immo', 'century21']
+
+
+class MockJinka:
+    # Données générées une seule fois au démarrage pour que les pages et leurs ETag restent stables
+    def __init__(self, nb_alerts=5, nb_pages=10, latency=0.0, error_rate=0.0, expired_rate=0.0, seed=0,
+                 throttle_rate=0.0, token_lifetime=0):
+        random.seed(seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        # Nombre de requêtes acceptées avec un même jeton, 0 pour un jeton qui n'expire jamais
+        self.token_lifetime = token_lifetime
+        self.tokens = 0
+        self.token_uses = 0
+        # Annonces dont le site répond 401, comme un site d'annonces qui demande sa propre connexion
+        self.unauthorized_listings = set()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.alerts = []
+        self.pages = {}
+        self.ads = {}
+        self.sources = {}
+        for alert_index in range(nb_alerts):
+            alert_id = f'alert{alert_index}'
+            self.alerts.append({'id': alert_id, 'name': f'Alerte {alert_index}', 'user_name': 'bench',
+                                'estimated_ads_per_day': ADS_PER_PAGE})
+            for page in range(1, nb_pages + 1):
+                ads = synthetic_page(page, alert_id, first_id=alert_index * 1000000)
+                for ad in ads:
+                    ad['source'] = random.choice(SOURCES)
+                    # Dates ISO 8601 comme celles de l'API, les plus récentes en première page
+                    send_date = datetime(2021, 3, 1) + timedelta(minutes=nb_pages - page)
+                    ad['sendDate'] = send_date.isoformat(timespec='milliseconds') + 'Z'
+                    if random.random() < expired_rate:
+                        ad['expired_at'] = '2021-03-01T10:00:00.000Z'
+                    self.sources[str(ad['id'])] = ad['source']
+                self.ads[(alert_id, page)] = ads
+        for alert_id, page in self.ads:
+            self.encode_page(alert_id, page)
+
+    def encode_page(self, alert_id, page):
+        nb_pages = sum(1 for key in self.ads if key[0] == alert_id)
+        pagination = {'nbPages': nb_pages, 'totals': {'all': nb_pages * ADS_PER_PAGE, 'read': 0,
+                                                      'unread': nb_pages * ADS_PER_PAGE, 'favorite': 0,
+                                                      'contact': 0, 'deleted': 0}}
+        self.pages[(alert_id, page)] = json.dumps({'ads': self.ads[(alert_id, page)],
+                                                   'pagination': pagination}).encode()
+
+    def remove_alert(self, alert_id):
+        # L'alerte est supprimée côté Jinka : elle disparaît de la liste et ses pages ne sont plus servies
+        with self.lock:
+            self.alerts = [alert for alert in self.alerts if alert['id'] != alert_id]
+            for key in [key for key in self.ads if key[0] == alert_id]:
+                del self.ads[key]
+                del self.pages[key]
+
+    def remove_ads(self, ids):
+        # Les annonces retirées de Jinka disparaissent de leurs pages, sans date d'expiration
+        ids = {str(appart_id) for appart_id in ids}
+        with self.lock:
+            for (alert_id, page), ads in self.ads.items():
+                self.ads[(alert_id, page)] = [ad for ad in ads if str(ad['id']) not in ids]
+                self.encode_page(alert_id, page)
+
+    def update_ads(self, ids, **fields):
+        # Modification côté Jinka des annonces données, par exemple un nouveau loyer ou une date d'expiration
+        ids = {str(appart_id) for appart_id in ids}
+        with self.lock:
+            for (alert_id, page), ads in self.ads.items():
+                if any(str(ad['id']) in ids for ad in ads):
+                    for ad in ads:
+                        if str(ad['id']) in ids:
+                            ad.update(fields)
+                    self.encode_page(alert_id, page)
+
+    def register_request(self):
+        # Renvoie le statut d'échec simulé de la requête, ou None
+        with self.lock:
+            self.requests += 1
+            draw = self.random.random()
+            if draw < self.error_rate:
+                return 500
+            if draw < self.error_rate + self.throttle_rate:
+                return 429
+            return None
+
+    def new_token(self):
+        with self.lock:
+            self.tokens += 1
+            self.token_uses = 0
+            return f'mock-token-{self.tokens}'
+
+    def check_token(self, authorization):
+        with self.lock:
+            if authorization != f'Bearer mock-token-{self.tokens}':
+                return False
+            self.token_uses += 1
+            if self.token_lifetime and self.token_uses > self.token_lifetime:
+                return False
+            return True
+
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def send_body(self, body, status=200, content_type='application/json', headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle_request(self):
+            failed = mock.register_request()
+            time.sleep(mock.latency)
+            if self.command == 'POST':
+                length = int(self.headers.get('Content-Length', 0))
+                self.rfile.read(length)
+            if failed == 429:
+                return self.send_body(b'{"error": "too many requests"}', status=429, headers={'Retry-After': '1'})
+            if failed:
+                return self.send_body(b'{"error": "mock failure"}', status=500)
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            dashboard = re.fullmatch(r'/apiv2/alert/([^/]+)/dashboard', url.path)
+            abuses = re.fullmatch(r'/apiv2/alert/([^/]+)/abuses', url.path)
+            listing = re.fullmatch(r'/listing/([^/]+)/([^/]+)', url.path)
+
+            if url.path == '/apiv2/user/auth':
+                return self.send_body(json.dumps({'access_token': mock.new_token()}).encode())
+            if url.path.startswith('/apiv2/') and not mock.check_token(self.headers.get('Authorization')):
+                return self.send_body(b'{"error": "token expired"}', status=401)
+            if url.path == '/apiv2/alert':
+                return self.send_body(json.dumps(mock.alerts).encode())
+            if dashboard:
+                body = mock.pages.get((dashboard.group(1), int(query.get('page', ['1'])[0])))
+                if body is None:
+                    return self.send_body(b'{"error": "not found"}', status=404)
+                etag = 'W/"' + hashlib.md5(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    return self.send_body(b'', status=304, headers={'ETag': etag})
+                return self.send_body(body, headers={'ETag': etag})
+            if url.path == '/alert_result_view_ad':
+                ad_id = query.get('ad', [''])[0]
+                # Les sites d'annonces sont servis sous un autre nom d'hôte que l'API, comme en production
+                location = f'http://localhost:{self.server.server_address[1]}/listing/' \
+                           f'{mock.sources.get(ad_id, "pap")}/{ad_id}'
+                return self.send_body(b'', status=302, headers={'Location': location})
+            if listing:
+                if listing.group(2) in mock.unauthorized_listings:
+                    return self.send_body(b'<html><body>Connexion requise</body></html>', status=401,
+                                          content_type='text/html')
+                return self.send_body(b'<html><body><h1>Annonce</h1></body></html>', content_type='text/html')
+            if abuses:
+                return self.send_body(b'{"status": "ok"}')
+            return self.send_body(b'{"error": "not found"}', status=404)
+
+        do_GET = handle_request
+        do_POST = handle_request
+
+    return Handler
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Le client ferme volontairement les connexions des pages d'annonces lues en streaming
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_server(mock, port=0):
+    server = QuietServer(('127.0.0.1', port), make_handler(mock))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the Jinka API.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--alerts', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 500.')
+    parser.add_argument('--expired-rate', type=float, default=0.0, help='Share of ads flagged as expired by Jinka.')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='Share of requests answered with a 429 and a Retry-After header.')
+    parser.add_argument('--token-lifetime', type=int, default=0,
+                        help='Number of API requests accepted with a same token, 0 for no expiration.')
+    args = parser.parse_args()
+
+    mock = MockJinka(args.alerts, args.pages, args.latency, args.error_rate, args.expired_rate,
+                     throttle_rate=args.throttle_rate, token_lifetime=args.token_lifetime)
+    server, root = start_server(mock, args.port)
+    print(f'Mock Jinka API listening on {root}, run with KAJIN_API_ROOT={root}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
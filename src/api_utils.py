@@ -1,45 +1,100 @@
-import pandas as pd
-import requests
 import os
-import time
-from datetime import datetime
-from bs4 import BeautifulSoup
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 from tqdm import tqdm, trange
 from logzero import logger
 
-
-def authenticate(email, password):
-    auth_url = 'https://api.jinka.fr/apiv2/user/auth'
+from expiry_utils import AppartPage, body_bytes_for, detect_expired
+from http_utils import ApiClient, cached_get
+from processing_utils import nested_hash
+
+# Surchargeable pour viser un serveur local, par exemple celui des benchmarks
+API_ROOT = os.environ.get('KAJIN_API_ROOT', 'https://api.jinka.fr')
+
+APPARTS_COLUMNS = ['id', 'source', 'source_is_partner', 'source_logo', 'source_label', 'search_type', 'owner_type',
+                   'rent', 'rent_max', 'area', 'room', 'bedroom', 'floor', 'type', 'buy_type', 'city', 'postal_code',
+                   'lat', 'lng', 'furnished', 'description', 'description_is_truncated', 'images', 'created_at',
+                   'expired_at', 'sendDate', 'previous_rent', 'previous_rent_at', 'favorite', 'nb_spam', 'contacted',
+                   'stops', 'features', 'new_real_estate', 'rentMinPerM2', 'clicked_at', 'webview_link', 'alert_id',
+                   'alert_ids', 'page']
+
+# Types des colonnes : catégories pour les textes peu variés, types numériques nullables et dates
+CATEGORY_COLUMNS = ['source', 'source_label', 'search_type', 'owner_type', 'type', 'buy_type', 'city', 'postal_code',
+                    'alert_id', 'alert_ids']
+INTEGER_COLUMNS = ['room', 'bedroom', 'floor', 'nb_spam', 'page']
+FLOAT_COLUMNS = ['rent', 'rent_max', 'area', 'previous_rent', 'rentMinPerM2', 'lat', 'lng']
+BOOLEAN_COLUMNS = ['source_is_partner', 'furnished', 'description_is_truncated', 'favorite', 'contacted',
+                   'new_real_estate']
+DATETIME_COLUMNS = ['created_at', 'expired_at', 'sendDate', 'previous_rent_at', 'clicked_at']
+HEAVY_COLUMNS = ['description', 'images']
+
+
+def login(client, email, password):
+    auth_url = API_ROOT + '/apiv2/user/auth'
     auth_dict = {'email': email, 'password': password}
-    s = requests.Session()
-    r_auth = s.post(auth_url, auth_dict)
+    r_auth = client.post(auth_url, auth_dict, refresh=False)
     if r_auth.status_code == 200:
         logger.info('Authentification succeeded (200)')
-        access_token = r_auth.json()['access_token']
-    else:
-        logger.critical(f'Authentification failed with error {r_auth.status_code}')
-        return None, None
+        return r_auth.json()['access_token']
+    logger.critical(f'Authentification failed with error {r_auth.status_code}')
+    return None
 
-    headers = {
+
+def authenticate(email, password, pool_size=10, rate_limit=None, response_hooks=()):
+    client = ApiClient(pool_size=pool_size, rate_limit=rate_limit, response_hooks=response_hooks)
+    client.headers.update({
         'Accept': '*/*',
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.190 Safari/537.36',
         'Accept-Language': 'fr,fr-FR;q=0.8,en-US;q=0.5,en;q=0.3',
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {access_token}',
         'Origin': 'https://www.jinka.fr',
         'Connection': 'keep-alive',
         'DNT': '1',
         'Sec-GPC': '1',
-        'If-None-Match': 'W/f46-qWZd5Nq9sjWAv9cj3oEhFaxFuek',
         'TE': 'Trailers',
-    }
-
-    return s, headers
-
-
-def get_alerts(session, headers):
+    })
+    access_token = login(client, email, password)
+    if access_token is None:
+        return None
+    client.set_token(access_token)
+    # Le jeton est redemandé si l'API répond 401 en cours d'exécution
+    client.login = lambda: login(client, email, password)
+    client.auth_host = urlparse(API_ROOT).netloc
+    return client
+
+
+def get_alert_summary(session, alert_id, cache=None):
+    # Même URL que la première page lue par get_apparts_page : ses annonces sont conservées pour ne pas la télécharger
+    # deux fois
+    target_url = f"{API_ROOT}/apiv2/alert/{alert_id}/dashboard?filter=all&page=1"
+    r_pagination = cached_get(session, target_url, cache=cache, alert_id=alert_id)
+    if r_pagination.status_code != 200:
+        logger.warning(f"Failed to fetch pagination data for alert ID {alert_id}.")
+        return {}
+    return r_pagination.json()
+
+
+def print_alerts(df_alerts, display='compact'):
+    if display == 'compact':
+        print(df_alerts[['id', 'name', 'ads_per_day', 'nb_pages', 'all', 'unread', 'favorite']].to_string(index=False))
+    elif display == 'full':
+        for alert in df_alerts.itertuples():
+            print(f"\nAlert ID: {alert.id}")
+            print(f"Name: {alert.name}")
+            print(f"User: {alert.user_name}")
+            print(f"Estimated Ads per Day: {alert.ads_per_day}")
+            print(f"Number of Pages: {alert.nb_pages}")
+            print(f"Total Ads: {alert.all}")
+            print(f"Read: {alert.read}")
+            print(f"Unread: {alert.unread}")
+            print(f"Favorites: {alert.favorite}")
+            print(f"Contacts: {alert.contact}")
+            print(f"Deleted: {alert.deleted}")
+
+
+def get_alerts(session, cache=None, max_in_flight=1, display='compact'):
     logger.info("Fetching alerts from Jinka API.")
-    r_alerts = session.get('https://api.jinka.fr/apiv2/alert', headers=headers)
+    r_alerts = cached_get(session, API_ROOT + '/apiv2/alert', cache=cache)
 
     # Vérification du statut de la requête
     if r_alerts.status_code != 200:
@@ -55,58 +110,47 @@ def get_alerts(session, headers):
         logger.error(f"Response: {r_alerts.text}")
         return pd.DataFrame()
 
+    # Résumés des alertes récupérés en parallèle sur la session partagée
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        summaries = list(executor.map(lambda alert: get_alert_summary(session, alert.get('id'), cache),
+                                      alerts_data))
+
     # Extraction des données
-    df_alerts = pd.DataFrame(columns=['id', 'name', 'user_name', 'ads_per_day'])
     data_dict = {
         'id': [], 'name': [], 'user_name': [], 'ads_per_day': [],
         'nb_pages': [], 'all': [], 'read': [], 'unread': [],
-        'favorite': [], 'contact': [], 'deleted': []
+        'favorite': [], 'contact': [], 'deleted': [], 'first_page_ads': []
     }
 
-    for counter, alert in enumerate(alerts_data):
+    for alert, summary in zip(alerts_data, summaries):
         data_dict['id'].append(alert.get('id'))
         data_dict['name'].append(alert.get('name'))
         data_dict['user_name'].append(alert.get('user_name'))
         data_dict['ads_per_day'].append(alert.get('estimated_ads_per_day'))
 
-        root_url = f"https://api.jinka.fr/apiv2/alert/{alert.get('id')}/dashboard"
-        r_pagination = session.get(root_url, headers=headers)
-        if r_pagination.status_code == 200:
-            pagination_data = r_pagination.json().get('pagination', {})
-            data_dict['nb_pages'].append(pagination_data.get('nbPages', 0))
-            totals = pagination_data.get('totals', {})
-            data_dict['all'].append(totals.get('all', 0))
-            data_dict['read'].append(totals.get('read', 0))
-            data_dict['unread'].append(totals.get('unread', 0))
-            data_dict['favorite'].append(totals.get('favorite', 0))
-            data_dict['contact'].append(totals.get('contact', 0))
-            data_dict['deleted'].append(totals.get('deleted', 0))
-        else:
-            logger.warning(f"Failed to fetch pagination data for alert ID {alert.get('id')}.")
-
-        logger.info(f"{counter + 1} / {len(alerts_data)} alerts have been processed.")
+        pagination_data = summary.get('pagination', {})
+        data_dict['nb_pages'].append(pagination_data.get('nbPages', 0))
+        totals = pagination_data.get('totals', {})
+        data_dict['all'].append(totals.get('all', 0))
+        data_dict['read'].append(totals.get('read', 0))
+        data_dict['unread'].append(totals.get('unread', 0))
+        data_dict['favorite'].append(totals.get('favorite', 0))
+        data_dict['contact'].append(totals.get('contact', 0))
+        data_dict['deleted'].append(totals.get('deleted', 0))
+        data_dict['first_page_ads'].append(summary.get('ads'))
+
+    logger.info(f"{len(alerts_data)} / {len(alerts_data)} alerts have been processed.")
 
     # Convertir les données en DataFrame
     df_alerts = pd.DataFrame(data=data_dict)
 
     # Affichage des alertes et leurs informations
-    for _, alert in df_alerts.iterrows():
-        print(f"\nAlert ID: {alert['id']}")
-        print(f"Name: {alert['name']}")
-        print(f"User: {alert['user_name']}")
-        print(f"Estimated Ads per Day: {alert['ads_per_day']}")
-        print(f"Number of Pages: {alert['nb_pages']}")
-        print(f"Total Ads: {alert['all']}")
-        print(f"Read: {alert['read']}")
-        print(f"Unread: {alert['unread']}")
-        print(f"Favorites: {alert['favorite']}")
-        print(f"Contacts: {alert['contact']}")
-        print(f"Deleted: {alert['deleted']}")
+    print_alerts(df_alerts, display)
 
     return df_alerts
 
 
-def get_appart_response(session, row_tuple):
+def get_appart_response(session, row_tuple, body_bytes=0):
     alert_id = row_tuple[1]['alert_id']
     appart_id = str(row_tuple[0])
 
@@ -124,244 +168,299 @@ def get_appart_response(session, row_tuple):
     }
 
     params = (('ad', appart_id), ('alert_token', alert_id))
+    url = API_ROOT + '/alert_result_view_ad'
+    # Les erreurs temporaires sont déjà retentées par le client
     try:
-        response = session.get('https://api.jinka.fr/alert_result_view_ad', headers=headers, params=params)
+        response = session.get(url, headers=headers, params=params, stream=True)
         response.raise_for_status()  # Vérifier si la requête a réussi
         logger.info(f"Fetched URL for ad ID {appart_id}: {response.url}")
 
         # Validation stricte pour éviter les liens génériques
         if "jinka.fr" in response.url and "alert_result_view_ad" not in response.url:
             logger.warning(f"Unexpected URL format for ad ID {appart_id}: {response.url}")
+            response.close()
             return None
 
-        return response.url  # Retourner l'URL spécifique si valide
+        # Seul le début de la page est lu, et uniquement si un détecteur d'expiration en a besoin
+        body = None
+        if body_bytes:
+            body = response.raw.read(body_bytes, decode_content=True).decode(response.encoding or 'utf-8',
+                                                                            errors='replace')
+        response.close()
+        return AppartPage(response.url, dict(response.headers), body)
     except Exception as e:
-        logger.warning(f"Error fetching ad {appart_id}: {e}. Retrying in 30 seconds.")
-        time.sleep(30)
-        try:
-            response = session.get('https://api.jinka.fr/alert_result_view_ad', headers=headers, params=params)
-            response.raise_for_status()
-            logger.info(f"Retry succeeded for ad ID {appart_id}: {response.url}")
-
-            # Même validation après le retry
-            if "jinka.fr" in response.url and "alert_result_view_ad" not in response.url:
-                logger.warning(f"Unexpected URL format after retry for ad ID {appart_id}: {response.url}")
-                return None
-
-            return response.url
-        except Exception as retry_error:
-            logger.error(f"Retry failed for ad {appart_id}: {retry_error}")
-            return None  # Retourne None si l'erreur persiste
-
-
-def expired_checker(response, row_tuple):
-    source = row_tuple[1]['source']
-    true_expired_date = None
-
-    if source in ['logic-immo', 'century21', 'meilleursagents', 'locservice', 'lagenceblue']:
-        parsed_url = BeautifulSoup(response.text, 'html.parser')
-    elif source in ['pap', 'seloger', 'paruvendu', 'laforet', 'orpi', 'avendrealouer', 'fnaim', 'locatair']:
-        parsed_url = response.url.split('/')
-    elif source == 'leboncoin':
-        true_expired_date = row_tuple[1]['expired_at']
-    else:
-        return true_expired_date
-
-    if source == 'logic-immo':
-        item = parsed_url.find_all(class_="expiredTxt")
-        if len(item) != 0:
-            true_expired_date = datetime.now()
-
-    if source == 'pap':
-        if parsed_url[3] == 'annonce':
-            true_expired_date = datetime.now()
-
-    if source == 'seloger':
-        if parsed_url[-1] == '#expiree':
-            true_expired_date = datetime.now()
-
-    if source == 'explorimmo':
-        pass
-
-    if source == 'paruvendu':
-        if parsed_url[-1] == '#showError404':
-            true_expired_date = datetime.now()
-
-    if source == 'century21':
-        item = parsed_url.find_all(class_="content_msg")
-        item2 = parsed_url.find_all(class_="tw-font-semibold tw-text-lg")
-        if len(item) != 0:
-            if item[0].strong.text == "Nous sommes désolés, la page à laquelle vous tentez d'accéder n'existe pas.":
-                true_expired_date = datetime.now()
-        if len(item2) != 0:
-            if item2[
-                0].text.strip() == "Cette annonce est désactivée, retrouvez ci-dessous une sélection de biens s'en rapprochant.":
-                true_expired_date = datetime.now()
-
-    if source == 'stephaneplaza':
-        pass
-
-    if source == 'meilleursagents':
-        item = parsed_url.find_all(class_="error-page")
-        if len(item) != 0:
-            true_expired_date = datetime.now()
-
-    if source == 'flatlooker':
-        pass
-
-    if source == 'bienici':
-        pass
-
-    if source == 'locservice':
-        item = parsed_url.find_all(class_="louerecemment")
-        if len(item) != 0:
-            true_expired_date = datetime.now()
-
-    if source == 'guyhoquet':
-        pass
-
-    if source == 'laforet':
-        if parsed_url[3] == 'ville':
-            true_expired_date = datetime.now()
-
-    if source == 'lagenceblue':
-        item = parsed_url.find_all(class_="label label-warning")
-        if len(item) != 0:
-            true_expired_date = datetime.now()
-
-    if source == 'avendrealouer':
-        if '#expiree' in parsed_url[-1]:
-            true_expired_date = datetime.now()
-
-    if source == 'orpi':
-        if parsed_url[-2] == 'louer-appartement':
-            true_expired_date = datetime.now()
-
-    if source == 'parisattitude':
-        pass
-
-    if source == 'fnaim':
-        if len(parsed_url) >= 3:
-            if parsed_url[3] != 'annonce-immobiliere':
-                true_expired_date = datetime.now()
-
-    if source == 'erafrance':
-        pass
-
-    return true_expired_date
-
-
-def get_all_links(session, df, expired, appart_db_path):
-    if os.path.exists(appart_db_path) and not expired:
-        logger.info('Found a preexisting links database.')
-        df['link'] = None
-        df_already_processed = pd.read_json(appart_db_path, orient='columns')
-        unprocessed_index = set(df.index) - set(df_already_processed.index)
-        processed_index = set(df.index).intersection(df_already_processed.index)
-        df.loc[list(processed_index), 'link'] = df_already_processed['link']
+        logger.error(f"Failed to fetch ad {appart_id}: {e}")
+        return None
+
+
+def get_all_links(session, df, expired, link_store, max_in_flight=1, checkpoint_every=50, processes=0):
+    df['link'] = None
+    if not expired:
+        known_links = link_store.get_links(df.index)
+        logger.info(f'Found {len(known_links)} already processed links in the links database.')
+        processed_index = [appart_id for appart_id in df.index if str(appart_id) in known_links]
+        df.loc[processed_index, 'link'] = [known_links[str(appart_id)] for appart_id in processed_index]
+        unprocessed_index = set(df.index) - set(processed_index)
     else:
-        if not os.path.exists(appart_db_path):
-            logger.warning('No preexisting database has been found, generating a new one.')
-        elif expired:
-            logger.warning('Replacing the previous database in order to check for apparts expiration.')
-        unprocessed_index = df.index
-        df_already_processed = pd.DataFrame()
-
-    links = []  # Initialiser une liste vide pour stocker les liens
-
-    for row_tuple in tqdm(df.iterrows(), total=len(df)):
-        if row_tuple[0] not in unprocessed_index:
-            continue  # Ne traiter que les indices non déjà traités
-        response_url = get_appart_response(session, row_tuple)
-        if response_url:
-            links.append(response_url)
-        else:
-            links.append("Invalid link")  # Indiquer explicitement un lien invalide
-
-    # Ajouter les liens au DataFrame
-    df.loc[list(unprocessed_index), 'link'] = links  # Conversion de set en liste
-    df_to_append = df.loc[list(unprocessed_index), ['link']]  # Conversion de set en liste
-
-    # Utiliser pd.concat à la place de append
-    df_already_processed = pd.concat([df_already_processed, df_to_append])
-    df_already_processed.to_json(appart_db_path, orient='columns')
+        logger.warning('Resolving every link again in order to check for apparts expiration.')
+        unprocessed_index = set(df.index)
+
+    resolved = {}
+    pending = {}
+    expired_dates = {}
+    # L'analyse des pages peut tourner dans des processus séparés pour ne pas bloquer les requêtes
+    parser_pool = ProcessPoolExecutor(max_workers=processes) if expired and processes else None
+
+    def checkpoint():
+        link_store.save_links(pending)
+        pending.clear()
+
+    logger.info(f'Resolving {len(unprocessed_index)} links with {max_in_flight} requests in flight.')
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {executor.submit(get_appart_response, session, row_tuple,
+                                   body_bytes=body_bytes_for(row_tuple[1]['source']) if expired else 0): row_tuple
+                   for row_tuple in df.iterrows() if row_tuple[0] in unprocessed_index}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            appart_id, row = futures[future]
+            page = future.result()
+            # Indiquer explicitement un lien invalide
+            resolved[appart_id] = page.url if page else "Invalid link"
+            pending[appart_id] = (row['alert_id'], resolved[appart_id])
+            if len(pending) >= checkpoint_every:
+                checkpoint()
+            if expired and page:
+                detector_args = (row['source'], page.url, page.headers, page.body, row['expired_at'])
+                if parser_pool is not None:
+                    expired_dates[appart_id] = parser_pool.submit(detect_expired, *detector_args)
+                else:
+                    expired_dates[appart_id] = detect_expired(*detector_args)
+    checkpoint()
+
+    if parser_pool is not None:
+        expired_dates = {appart_id: date.result() for appart_id, date in expired_dates.items()}
+        parser_pool.shutdown()
+    expired_dates = {appart_id: date for appart_id, date in expired_dates.items() if date is not None}
+    if expired_dates:
+        logger.warning(f'{len(expired_dates)} apparts have been detected as expired.')
+        df['expired_at'] = to_datetime_column(df['expired_at'])
+        df.loc[list(expired_dates), 'expired_at'] = pd.to_datetime(pd.Series(expired_dates))
+
+    if resolved:
+        df.loc[list(resolved), 'link'] = pd.Series(resolved)
 
     return df
 
-    links = []  # Initialiser une liste vide pour stocker les liens
 
-    for row_tuple in tqdm(df.iterrows(), total=len(df)):
-        if row_tuple[0] not in unprocessed_index:
-            continue  # Ne traiter que les indices non déjà traités
-        response = get_appart_response(session, row_tuple)
-        true_url = response.url
-        links.append(true_url)  # Ajouter le lien à la liste
-
-    # Ajouter les liens au DataFrame
-    df.loc[list(unprocessed_index), 'link'] = links  # Conversion de set en liste
-    df_to_append = df.loc[list(unprocessed_index), ['link']]  # Conversion de set en liste
-
-    # Utiliser pd.concat à la place de append
-    df_already_processed = pd.concat([df_already_processed, df_to_append])
-    df_already_processed.to_json(appart_db_path, orient='columns')
-
-    return df
+def report_expired(session, appart_id, alert_id, reason='ad_link_404'):
+    post_url = API_ROOT + '/apiv2/alert/' + str(alert_id) + '/abuses'
+    data = {'ad_id': appart_id, 'reason': reason}
+    # Les erreurs temporaires (429, 5xx, réseau) sont déjà retentées par le client
+    try:
+        response = session.post(post_url, data=data)
+    except Exception as e:
+        logger.error(f'Failed to report ad {appart_id}: {e}')
+        return False
+    if not response.ok:
+        logger.error(f'Jinka refused the report of ad {appart_id}: HTTP {response.status_code}.')
+        return False
+    return True
 
 
-def remove_expired(session, df, last_deleted_path):
+def remove_expired(session, df, last_deleted_path, report_store, max_in_flight=1, max_expired=15, dry_run=False,
+                   reason='ad_link_404'):
     df_expired = df.loc[df["expired_at"].notna(), :]
-    if len(df_expired) > 15:
-        logger.critical('Df slicing error')
-        exit()
-    logger.info('Starting the cleaning of expired offers.')
-    for appart_id, row in tqdm(df_expired.iterrows()):
-        post_url = 'https://api.jinka.fr/apiv2/alert/' + row['alert_id'] + '/abuses'
-        data = {'ad_id': appart_id, 'reason': 'ad_link_404'}
-        session.post(post_url, data=data)
+    reported = report_store.reported_ids(df_expired.index)
+    to_report = {appart_id: row['alert_id'] for appart_id, row in df_expired.iterrows()
+                 if str(appart_id) not in reported}
+    logger.info(f'{len(df_expired)} expired offers, {len(reported)} of them were already reported.')
+    # Seuil de sécurité : un nombre anormal d'annonces expirées trahit plutôt une erreur de détection
+    if max_expired and len(to_report) > max_expired:
+        logger.critical(f'{len(to_report)} offers to report exceed the safety threshold of {max_expired}, '
+                        f'nothing is reported nor removed. Raise --max-expired to clean them up.')
+        return df
+
+    if dry_run:
+        for appart_id, alert_id in to_report.items():
+            logger.info(f'Dry run: would report ad {appart_id} of alert {alert_id} as {reason}.')
+    elif to_report:
+        logger.info(f'Reporting {len(to_report)} expired offers with {max_in_flight} requests in flight.')
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            futures = {executor.submit(report_expired, session, appart_id, alert_id, reason):
+                       (appart_id, alert_id) for appart_id, alert_id in to_report.items()}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                appart_id, alert_id = futures[future]
+                # Chaque signalement réussi est enregistré aussitôt, les échecs seront retentés au prochain run
+                if future.result():
+                    report_store.save_reports({appart_id: alert_id}, reason)
+                else:
+                    failed.append(appart_id)
+        if failed:
+            logger.warning(f'{len(failed)} reports failed and will be sent again on the next run.')
+
     df_expired.to_json(last_deleted_path, orient='columns')
     cleaned_df = df.loc[df['expired_at'].isna(), :]
     logger.info(f'Finished cleaning the {len(df_expired)} expired appartments.')
     return cleaned_df
 
 
-def get_apparts(session, headers, alert_id, nb_pages):
-    root_url = 'https://api.jinka.fr/apiv2/alert/' + str(alert_id) + '/dashboard'
-    df_apparts = pd.DataFrame(
-        columns=['id', 'source', 'source_is_partner', 'source_logo', 'source_label', 'search_type', 'owner_type', \
-                 'rent', 'rent_max', 'area', 'room', 'bedroom', 'floor', 'type', 'buy_type', 'city', 'postal_code',
-                 'lat', 'lng', 'furnished', \
-                 'description', 'description_is_truncated', 'images', 'created_at', 'expired_at', 'sendDate',
-                 'previous_rent', 'previous_rent_at', \
-                 'favorite', 'nb_spam', 'contacted', 'stops', 'features', 'new_real_estate', 'rentMinPerM2',
-                 'clicked_at', 'webview_link', 'alert_id', \
-                 'page'])
-    for page in trange(1, nb_pages + 1):
-        target_url = root_url + f'?filter=all&page={page}'
-        r_apparts = session.get(target_url, headers=headers)
-        df_temp = pd.DataFrame.from_records(data=r_apparts.json()['ads'])
-        df_temp['page'] = page
-        df_apparts = pd.concat([df_apparts, df_temp], ignore_index=True)
-    return df_apparts
-
-
-def get_all_apparts(df_alerts, session, headers):
-    df_final = pd.DataFrame(columns=['id', 'source', 'source_is_partner', 'source_logo', 'source_label',
-                                     'search_type', 'owner_type', 'rent', 'rent_max', 'area', 'room', 'bedroom',
-                                     'floor', 'type', 'buy_type',
-                                     'city', 'postal_code', 'lat', 'lng', 'furnished', 'description',
-                                     'description_is_truncated', 'images',
-                                     'created_at', 'expired_at', 'sendDate', 'previous_rent', 'previous_rent_at',
-                                     'favorite', 'nb_spam', 'contacted',
-                                     'stops', 'features', 'new_real_estate', 'rentMinPerM2', 'clicked_at',
-                                     'webview_link', 'alert_id'])
-    for idx, alert in df_alerts.iterrows():
-        logger.info(f'Starting the processing of the apparts of alert n°{idx + 1}')
-        alert_id = alert['id']
-        nb_pages = alert['nb_pages']
-        df_alert = get_apparts(session, headers, alert_id, nb_pages)
-        df_final = pd.concat([df_final, df_alert], ignore_index=True)
-        logger.info(f'Finished processing the apparts of alert n°{idx + 1}')
-    df_final = df_final.set_index('id')
+def get_apparts_page(session, alert_id, page, cache=None, prefetched=None):
+    if prefetched is not None:
+        ads = prefetched
+    else:
+        target_url = API_ROOT + '/apiv2/alert/' + str(alert_id) + f'/dashboard?filter=all&page={page}'
+        r_apparts = cached_get(session, target_url, cache=cache, alert_id=alert_id)
+        if r_apparts.status_code != 200:
+            logger.error(f'Failed to fetch page {page} of alert {alert_id}: HTTP {r_apparts.status_code}.')
+            return []
+        ads = r_apparts.json()['ads']
+    for ad in ads:
+        ad['page'] = page
+        ad.setdefault('alert_id', alert_id)
+        ad['nested_hash'] = nested_hash(ad)
+    return ads
+
+
+def build_apparts_df(records, exclude=()):
+    # Construction unique du DataFrame : les colonnes inattendues sont conservées après le schéma
+    df_apparts = pd.DataFrame.from_records(records).drop(columns=list(exclude), errors='ignore')
+    extra_columns = [column for column in df_apparts.columns if column not in APPARTS_COLUMNS]
+    return df_apparts.reindex(columns=[column for column in APPARTS_COLUMNS if column not in exclude] + extra_columns)
+
+
+def to_datetime_column(series):
+    # Dates stockées en UTC sans fuseau, ce qu'attendent aussi les exports Excel
+    return pd.to_datetime(series, errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None)
+
+
+# L'historique SQLite rend les booléens sous forme de 0/1, l'ancien historique CSV sous forme de texte
+BOOLEAN_VALUES = {True: True, False: False, 'True': True, 'False': False, 'true': True, 'false': False,
+                  '1': True, '0': False}
+
+
+def to_boolean_column(series):
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype('boolean')
+    return series.astype(object).map(BOOLEAN_VALUES).astype('boolean')
+
+
+def apply_schema(df):
+    # Idempotent : peut être réappliqué sur des lignes venant de l'historique
+    for column in df.columns.intersection(FLOAT_COLUMNS):
+        df[column] = pd.to_numeric(df[column], errors='coerce').astype('Float64')
+    for column in df.columns.intersection(INTEGER_COLUMNS):
+        values = pd.to_numeric(df[column], errors='coerce').astype('Float64')
+        df[column] = values.astype('Int64') if (values.dropna() % 1 == 0).all() else values
+    for column in df.columns.intersection(BOOLEAN_COLUMNS):
+        try:
+            df[column] = to_boolean_column(df[column])
+        except (TypeError, ValueError):
+            logger.warning(f'Column {column} could not be converted to booleans.')
+    for column in df.columns.intersection(DATETIME_COLUMNS):
+        df[column] = to_datetime_column(df[column])
+    for column in df.columns.intersection(CATEGORY_COLUMNS):
+        df[column] = df[column].astype('category')
+    return df
+
+
+def deduplicate_ads(records):
+    # Une annonce présente dans plusieurs alertes n'est gardée qu'une fois, avec la liste de ses alertes
+    unique_ads = {}
+    for ad in records:
+        known_ad = unique_ads.get(ad['id'])
+        if known_ad is None:
+            ad['alert_ids'] = [ad['alert_id']]
+            unique_ads[ad['id']] = ad
+        elif ad['alert_id'] not in known_ad['alert_ids']:
+            known_ad['alert_ids'].append(ad['alert_id'])
+    for ad in unique_ads.values():
+        ad['alert_ids'] = ', '.join(str(alert_id) for alert_id in ad['alert_ids'])
+    return list(unique_ads.values())
+
+
+def first_pages(df_alerts):
+    # Annonces de la première page déjà récupérées par get_alerts, indexées par id d'alerte
+    if 'first_page_ads' not in df_alerts:
+        return {}
+    return {alert_id: ads for alert_id, ads in zip(df_alerts['id'], df_alerts['first_page_ads']) if ads is not None}
+
+
+def get_all_apparts_concurrent(df_alerts, session, max_in_flight, cache=None):
+    prefetched = first_pages(df_alerts)
+    jobs = [(alert['id'], page) for _, alert in df_alerts.iterrows() for page in range(1, alert['nb_pages'] + 1)]
+    logger.info(f'Fetching {len(jobs)} pages from {len(df_alerts)} alerts with {max_in_flight} requests in flight.')
+    pages = {}
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {executor.submit(get_apparts_page, session, alert_id, page, cache,
+                                   prefetched.get(alert_id) if page == 1 else None):
+                   (alert_id, page) for alert_id, page in jobs}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            pages[futures[future]] = future.result()
+    # Réassemblage dans l'ordre des alertes puis des pages, indépendamment de l'ordre d'arrivée
+    return [ad for job in jobs for ad in pages[job]]
+
+
+def known_page_checker(known_ids, newest_send_dates):
+    # Une page est connue si toutes ses annonces le sont déjà, ou si elles sont toutes plus anciennes que
+    # la plus récente annonce connue de l'alerte
+    # Les dates de l'historique sont du texte "AAAA-MM-JJ HH:MM:SS", celles de l'API de l'ISO 8601 en UTC :
+    # elles sont comparées en dates, jamais en texte
+    newest_send_dates = to_datetime_column(pd.Series(newest_send_dates, dtype=object))
+
+    def is_known_page(alert_id, ads):
+        ids = {str(ad['id']) for ad in ads}
+        if not ids or known_ids(ids) >= ids:
+            return True
+        newest = newest_send_dates.get(str(alert_id))
+        if newest is None or pd.isna(newest):
+            return False
+        send_dates = to_datetime_column(pd.Series([ad.get('sendDate') for ad in ads], dtype=object))
+        return bool((send_dates.isna() | (send_dates <= newest)).all())
+    return is_known_page
+
+
+def get_apparts_delta(session, alert_id, nb_pages, is_known_page, cache=None, first_page_ads=None):
+    records = []
+    for page in range(1, nb_pages + 1):
+        ads = get_apparts_page(session, alert_id, page, cache, first_page_ads if page == 1 else None)
+        records.extend(ads)
+        if is_known_page(alert_id, ads):
+            logger.info(f'Alert {alert_id}: page {page} / {nb_pages} only contains known apparts, stopping there.')
+            break
+    return records
+
+
+def get_all_apparts_delta(df_alerts, session, is_known_page, max_in_flight=1, cache=None):
+    # Les pages d'une alerte sont lues dans l'ordre jusqu'à la première page connue, les alertes en parallèle
+    prefetched = first_pages(df_alerts)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = [executor.submit(get_apparts_delta, session, alert['id'], alert['nb_pages'], is_known_page, cache,
+                                   prefetched.get(alert['id'])) for _, alert in df_alerts.iterrows()]
+        return [ad for future in futures for ad in future.result()]
+
+
+def get_all_apparts(df_alerts, session, max_in_flight=1, cache=None, is_known_page=None, drop_heavy=False):
+    if is_known_page is not None:
+        records = get_all_apparts_delta(df_alerts, session, is_known_page, max_in_flight, cache)
+        logger.info(f'Delta sync fetched {len(records)} apparts.')
+    elif max_in_flight > 1:
+        records = get_all_apparts_concurrent(df_alerts, session, max_in_flight, cache)
+    else:
+        records = []
+        prefetched = first_pages(df_alerts)
+        for idx, alert in df_alerts.iterrows():
+            logger.info(f'Starting the processing of the apparts of alert n°{idx + 1}')
+            for page in trange(1, alert['nb_pages'] + 1):
+                records.extend(get_apparts_page(session, alert['id'], page, cache=cache,
+                                                prefetched=prefetched.get(alert['id']) if page == 1 else None))
+            logger.info(f'Finished processing the apparts of alert n°{idx + 1}')
+    unique_records = deduplicate_ads(records)
+    logger.info(f'{len(records) - len(unique_records)} duplicated apparts found in several alerts have been merged.')
+    # Les colonnes volumineuses (description, images) peuvent ne jamais être chargées
+    df_final = build_apparts_df(unique_records, exclude=HEAVY_COLUMNS if drop_heavy else ()).set_index('id')
+    df_final = apply_schema(df_final)
+    if cache is not None:
+        logger.info(f'{cache.hits} pages have been served from the cache since the start of the run.')
     expired_index = df_final[df_final['expired_at'].notna()].index
     logger.warning(f"{len(expired_index)} apparts have expired.")
     return df_final, expired_index
\ No newline at end of file
@@ -0,0 +1,100 @@
+import json
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+from logzero import logger
+
+from api_utils import apply_schema
+
+
+def account_name(account):
+    # Nom du dossier du compte : son nom s'il en a un, sinon la partie locale de son email
+    name = account.get('name') or account['email'].split('@')[0]
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+def load_accounts(accounts_path):
+    # Liste JSON de comptes : [{"email": ..., "password": ..., "name": ... (facultatif)}, ...]
+    with open(accounts_path, 'r') as f:
+        accounts = json.load(f)
+    names = [account_name(account) for account in accounts]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Several accounts share the name {', '.join(sorted(duplicates))}, give them distinct names.")
+    return dict(zip(names, accounts))
+
+
+def strip_options(argv, options):
+    # Retire de la ligne de commande les options données et leur valeur, sous la forme "-o valeur" ou "--option=valeur"
+    stripped = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in options:
+            skip = True
+        elif not any(arg.startswith(option + '=') for option in options if option.startswith('--')):
+            stripped.append(arg)
+    return stripped
+
+
+def prepare_account(account_path, account, credentials_name='credentials.json'):
+    # Chaque compte a son propre dossier de travail, avec ses identifiants au format de l'option --save
+    databases_path = os.path.join(account_path, 'databases')
+    os.makedirs(databases_path, exist_ok=True)
+    os.makedirs(os.path.join(account_path, 'data'), exist_ok=True)
+    with open(os.path.join(databases_path, credentials_name), 'w') as f:
+        json.dump({'-EMAIL-': account['email'], '-PASSWORD-': account['password']}, f)
+
+
+def run_account(name, account_path, command):
+    # Le compte tourne dans son propre processus : session, caches, bases et journaux lui sont propres
+    # Le dossier est donné explicitement : un compte nommé src ne doit pas travailler dans le dossier parent
+    env = {**os.environ, 'KAJIN_ROOT': os.path.abspath(account_path)}
+    started_at = time.time()
+    start = time.monotonic()
+    with open(os.path.join(account_path, 'databases', 'batch_output.log'), 'w') as output:
+        returncode = subprocess.run(command, cwd=account_path, env=env, stdout=output,
+                                    stderr=subprocess.STDOUT).returncode
+    return {'account': name, 'returncode': returncode, 'started_at': started_at,
+            'duration_s': round(time.monotonic() - start, 3)}
+
+
+def run_accounts(accounts, accounts_root, command, max_parallel):
+    # accounts : {nom: compte} ; au plus max_parallel comptes tournent en même temps
+    results = []
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = {}
+        for name, account in accounts.items():
+            account_path = os.path.join(accounts_root, name)
+            prepare_account(account_path, account)
+            futures[executor.submit(run_account, name, account_path, command)] = name
+        for future in as_completed(futures):
+            result = future.result()
+            if result['returncode'] == 0:
+                logger.info(f"Account {result['account']} synchronised in {result['duration_s']:.1f}s.")
+            else:
+                logger.error(f"Account {result['account']} failed with the exit code {result['returncode']}, "
+                             f"see {os.path.join(accounts_root, result['account'], 'databases', 'batch_output.log')}.")
+            results.append(result)
+    return sorted(results, key=lambda result: result['account'])
+
+
+def merge_datasets(csv_paths, sep=';'):
+    # csv_paths : {nom du compte: chemin de son export} ; une annonce suivie par plusieurs comptes n'apparaît
+    # qu'une fois, avec la liste de ses comptes, comme alert_ids pour les alertes
+    frames = []
+    for name, csv_path in csv_paths.items():
+        if os.path.exists(csv_path):
+            frames.append(pd.read_csv(csv_path, sep=sep, encoding='utf-8', index_col='id').assign(account=name))
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames)
+    accounts = df.groupby(level=0, sort=False)['account'].agg(', '.join)
+    df = df.loc[~df.index.duplicated()].drop(columns='account')
+    df['accounts'] = accounts.reindex(df.index)
+    return apply_schema(df)
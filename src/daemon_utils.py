@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logzero import logger
+
+
+class StatusBoard:
+    # État du mode daemon, écrit dans un fichier JSON et servi en local si un port est donné
+    def __init__(self, status_path, port=None, interval=None):
+        self.status_path = status_path
+        self.status = {'state': 'starting', 'pid': os.getpid(), 'interval': interval, 'runs': 0, 'failures': 0,
+                       'last_run': None, 'last_error': None, 'next_run_at': None}
+        self.lock = threading.Lock()
+        self.server = self.serve(port) if port else None
+        self.update()
+
+    def update(self, **fields):
+        with self.lock:
+            self.status.update(fields)
+            self.status['updated_at'] = datetime.now().isoformat(timespec='seconds')
+            body = json.dumps(self.status, indent=2)
+        # Écriture atomique : un lecteur ne voit jamais un fichier à moitié écrit
+        with open(self.status_path + '.tmp', 'w') as f:
+            f.write(body)
+        os.replace(self.status_path + '.tmp', self.status_path)
+
+    def serve(self, port):
+        board = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with board.lock:
+                    body = json.dumps(board.status, indent=2).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f'Status served on http://127.0.0.1:{server.server_address[1]}/')
+        return server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.update(state='stopped', next_run_at=None)
+
+
+def run_forever(run_once, interval, status_board, max_runs=None):
+    # Les exécutions démarrent toutes les interval secondes ; une exécution en échec n'arrête pas le daemon
+    runs = 0
+    try:
+        while max_runs is None or runs < max_runs:
+            start = time.monotonic()
+            status_board.update(state='running', started_at=datetime.now().isoformat(timespec='seconds'))
+            try:
+                report = run_once()
+                status_board.update(runs=status_board.status['runs'] + 1, last_run=report, last_error=None)
+            except Exception as e:
+                logger.exception(f'The run failed: {e}')
+                status_board.update(failures=status_board.status['failures'] + 1, last_error=repr(e))
+            runs += 1
+            if max_runs is not None and runs >= max_runs:
+                break
+            delay = max(0.0, interval - (time.monotonic() - start))
+            next_run_at = (datetime.now() + timedelta(seconds=delay)).isoformat(timespec='seconds')
+            status_board.update(state='idle', next_run_at=next_run_at)
+            logger.info(f'Next synchronisation at {next_run_at}.')
+            time.sleep(delay)
+    except KeyboardInterrupt:
+        logger.info('Daemon interrupted.')
+    finally:
+        status_board.close()
@@ -0,0 +1,84 @@
+import html
+import re
+from collections import namedtuple
+from datetime import datetime
+
+import pandas as pd
+
+# Ce qu'un détecteur consulte : 'listing' (la date d'expiration fournie par Jinka), 'url' (l'URL finale après
+# redirection), 'headers' (les en-têtes de la réponse) ou 'body' (les body_bytes premiers octets de la page)
+Detector = namedtuple('Detector', ['needs', 'check', 'body_bytes'])
+AppartPage = namedtuple('AppartPage', ['url', 'headers', 'body'])
+
+BODY_PREFIX_BYTES = 256 * 1024
+DETECTORS = {}
+
+
+def register(source, needs='url', body_bytes=BODY_PREFIX_BYTES):
+    def decorator(check):
+        DETECTORS[source] = Detector(needs, check, body_bytes if needs == 'body' else 0)
+        return check
+    return decorator
+
+
+def body_bytes_for(source):
+    detector = DETECTORS.get(source)
+    return detector.body_bytes if detector is not None else 0
+
+
+def detect_expired(source, url=None, headers=None, body=None, expired_at=None):
+    # Fonction de module pour pouvoir être exécutée dans un ProcessPoolExecutor
+    detector = DETECTORS.get(source)
+    if detector is None:
+        return None
+    if detector.needs == 'listing':
+        return expired_at if detector.check(expired_at) else None
+    if detector.needs == 'url':
+        expired = detector.check(url.split('/'))
+    elif detector.needs == 'headers':
+        expired = detector.check(headers or {})
+    else:
+        expired = detector.check(html.unescape(body or ''))
+    return datetime.now() if expired else None
+
+
+def has_class(class_name):
+    pattern = re.compile(r'class=["\'][^"\']*\b' + re.escape(class_name) + r'\b')
+    return lambda body: pattern.search(body) is not None
+
+
+def has_text(*sentences):
+    patterns = [re.compile(re.escape(sentence)) for sentence in sentences]
+    return lambda body: any(pattern.search(body) for pattern in patterns)
+
+
+def url_part(position, value):
+    return lambda parts: len(parts) > abs(position) and parts[position] == value
+
+
+register('leboncoin', needs='listing')(pd.notna)
+
+register('logic-immo', needs='body')(has_class('expiredTxt'))
+register('meilleursagents', needs='body')(has_class('error-page'))
+register('locservice', needs='body')(has_class('louerecemment'))
+register('lagenceblue', needs='body')(
+    has_text('class="label label-warning"', "class='label label-warning'"))
+register('century21', needs='body')(has_text(
+    "Nous sommes désolés, la page à laquelle vous tentez d'accéder n'existe pas.",
+    "Cette annonce est désactivée, retrouvez ci-dessous une sélection de biens s'en rapprochant."))
+
+register('pap')(url_part(3, 'annonce'))
+register('seloger')(url_part(-1, '#expiree'))
+register('paruvendu')(url_part(-1, '#showError404'))
+register('laforet')(url_part(3, 'ville'))
+register('orpi')(url_part(-2, 'louer-appartement'))
+
+
+@register('avendrealouer')
+def avendrealouer_expired(parts):
+    return '#expiree' in parts[-1]
+
+
+@register('fnaim')
+def fnaim_expired(parts):
+    return len(parts) > 3 and parts[3] != 'annonce-immobiliere'
@@ -0,0 +1,82 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from logzero import logger
+
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
+
+def stringify_containers(series):
+    # Listes et dictionnaires écrits sous leur représentation texte, comme le faisait to_excel
+    return series.map(lambda x: str(x) if isinstance(x, (list, dict, set, tuple)) else x)
+
+
+def sanitize_for_excel(df):
+    # Un seul passage, uniquement sur les colonnes de texte
+    df = df.copy()
+    for column in df.columns:
+        dtype = df[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            categories = df[column].cat.categories
+            if pd.api.types.is_string_dtype(categories):
+                cleaned = categories.str.replace(ILLEGAL_CHARACTERS_RE, '', regex=True)
+                if cleaned.is_unique:
+                    df[column] = df[column].cat.rename_categories(cleaned)
+                else:
+                    df[column] = df[column].astype(str).str.replace(ILLEGAL_CHARACTERS_RE, '', regex=True)
+        elif pd.api.types.is_string_dtype(dtype) or dtype == object:
+            values = stringify_containers(df[column]) if dtype == object else df[column]
+            is_text = values.map(lambda x: isinstance(x, str)) if dtype == object else values.notna()
+            values = values.astype(object)
+            values[is_text] = values[is_text].str.replace(ILLEGAL_CHARACTERS_RE, '', regex=True)
+            df[column] = values
+    return df
+
+
+def write_csv(df, csv_path, sep=';'):
+    df.to_csv(csv_path, sep=sep, encoding='utf-8')
+    return csv_path
+
+
+def write_xlsx(df, xlsx_path):
+    from openpyxl import Workbook
+
+    # Classeur en écriture seule : les lignes sont envoyées au fichier au fur et à mesure
+    df = sanitize_for_excel(df)
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append([df.index.name] + [str(column) for column in df.columns])
+    columns = [df.index.astype(object).where(df.index.notna(), None).tolist()]
+    for column in df.columns:
+        values = df[column].astype(object)
+        columns.append(values.where(values.notna(), None).tolist())
+    for row in zip(*columns):
+        worksheet.append(row)
+    workbook.save(xlsx_path)
+    return xlsx_path
+
+
+def write_parquet(df, parquet_path):
+    try:
+        df = df.copy()
+        for column in df.columns[df.dtypes == object]:
+            df[column] = stringify_containers(df[column])
+        df.to_parquet(parquet_path)
+    except ImportError:
+        logger.warning('Parquet export requires pyarrow or fastparquet, skipping it.')
+        return None
+    return parquet_path
+
+
+def export_apparts(df, csv_path, xlsx_path=None, parquet_path=None):
+    # Les différents formats sont écrits en parallèle
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(write_csv, df, csv_path)]
+        if xlsx_path is not None:
+            futures.append(executor.submit(write_xlsx, df, xlsx_path))
+        if parquet_path is not None:
+            futures.append(executor.submit(write_parquet, df, parquet_path))
+        written = [future.result() for future in futures]
+    logger.info(f"Exported {len(df)} apparts to {', '.join(path for path in written if path)}.")
+    return written
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    # Distance en mètres entre des tableaux de coordonnées, avec la diffusion de numpy (broadcasting)
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def coordinates(df):
+    # Coordonnées numériques ; les annonces d'un ancien historique n'ont que geo_coords ("lat, lng")
+    lat = pd.to_numeric(df['lat'], errors='coerce') if 'lat' in df else pd.Series(np.nan, index=df.index)
+    lng = pd.to_numeric(df['lng'], errors='coerce') if 'lng' in df else pd.Series(np.nan, index=df.index)
+    if 'geo_coords' in df:
+        parts = df['geo_coords'].astype('string').str.split(',', n=1, expand=True)
+        if parts.shape[1] == 2:
+            lat = lat.fillna(pd.to_numeric(parts[0], errors='coerce'))
+            lng = lng.fillna(pd.to_numeric(parts[1], errors='coerce'))
+    return lat.to_numpy(dtype=float, na_value=np.nan), lng.to_numpy(dtype=float, na_value=np.nan)
+
+
+class GridIndex:
+    # Grille de cellules carrées sur une projection locale en mètres, triée par cellule : les voisins d'un point
+    # ne sont cherchés que dans les cellules proches de la sienne, pour tous les points à la fois
+    def __init__(self, lat, lng, cell_size=500):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lng = np.asarray(lng, dtype=float)
+        self.cell_size = cell_size
+        valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lng)))
+        self.lat_ref = np.radians(self.lat[valid].mean()) if len(valid) else 0.0
+        keys = self.key(*self.cells(self.lat[valid], self.lng[valid]))
+        order = np.argsort(keys, kind='stable')
+        self.points = valid[order]
+        self.keys, self.starts, self.counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    def cells(self, lat, lng):
+        x = EARTH_RADIUS_M * np.radians(lng) * np.cos(self.lat_ref)
+        y = EARTH_RADIUS_M * np.radians(lat)
+        return np.floor(x / self.cell_size).astype(np.int64), np.floor(y / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def key(cell_x, cell_y):
+        return cell_x * 2 ** 32 + (cell_y + 2 ** 31)
+
+    def candidates(self, cell_x, cell_y, reach):
+        # Paires (requête, point indexé) pour chaque point des cellules à moins de reach cellules de la requête
+        queries, points = [], []
+        if not len(self.keys):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                keys = self.key(cell_x + dx, cell_y + dy)
+                positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+                found = self.keys[positions] == keys
+                starts = self.starts[positions[found]]
+                counts = self.counts[positions[found]]
+                # Chaque requête est répétée autant de fois que sa cellule voisine contient de points
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                queries.append(np.repeat(np.flatnonzero(found), counts))
+                points.append(self.points[np.repeat(starts, counts) + offsets])
+        return np.concatenate(queries), np.concatenate(points)
+
+    def within(self, lat, lng, radius):
+        # Tous les points indexés à moins de radius mètres de chaque requête : (requêtes, points, distances)
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lng = np.atleast_1d(np.asarray(lng, dtype=float))
+        valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lng)))
+        reach = int(np.ceil(radius / self.cell_size))
+        queries, points = self.candidates(*self.cells(lat[valid], lng[valid]), reach)
+        queries = valid[queries]
+        distances = haversine(lat[queries], lng[queries], self.lat[points], self.lng[points])
+        close = distances <= radius
+        return queries[close], points[close], distances[close]
+
+
+def nearest(queries, points, distances, k):
+    # Garde les k paires les plus proches de chaque requête
+    order = np.lexsort((distances, queries))
+    sorted_queries = queries[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_queries, sorted_queries)
+    kept = order[rank < k]
+    return queries[kept], points[kept], distances[kept]
+
+
+def poi_distances(df, pois):
+    # pois : {nom: (lat, lng)} ; la matrice annonces × points d'intérêt est calculée d'un coup
+    if not pois:
+        return df
+    lat, lng = coordinates(df)
+    poi_lat = np.array([coords[0] for coords in pois.values()])
+    poi_lng = np.array([coords[1] for coords in pois.values()])
+    distances = haversine(lat[:, None], lng[:, None], poi_lat[None, :], poi_lng[None, :])
+    for position, name in enumerate(pois):
+        df[f'distance_{name}'] = pd.array(np.round(distances[:, position]), dtype='Float64')
+    return df
+
+
+def neighbour_features(df, radius=500, k=5):
+    # Densité d'annonces autour de chacune et comparaison de son prix au m² avec celui de ses k plus proches voisines
+    lat, lng = coordinates(df)
+    has_coords = ~(np.isnan(lat) | np.isnan(lng))
+    index = GridIndex(lat, lng, cell_size=radius)
+    queries, points, distances = index.within(lat, lng, radius)
+    others = queries != points
+    queries, points, distances = queries[others], points[others], distances[others]
+
+    neighbours = np.bincount(queries, minlength=len(df))
+    df['neighbours'] = pd.array(np.where(has_coords, neighbours, np.nan), dtype='Float64').astype('Int64')
+    df['density_km2'] = pd.array(np.where(has_coords, neighbours / (np.pi * (radius / 1000) ** 2), np.nan),
+                                 dtype='Float64')
+
+    price_m2 = pd.to_numeric(df['price_m2'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    queries, points, _ = nearest(queries, points, distances, k)
+    prices = price_m2[points]
+    priced = ~np.isnan(prices)
+    totals = np.bincount(queries[priced], weights=prices[priced], minlength=len(df))
+    counts = np.bincount(queries[priced], minlength=len(df))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        neighbours_price_m2 = np.where(counts > 0, totals / counts, np.nan)
+        df['neighbours_price_m2'] = pd.array(neighbours_price_m2, dtype='Float64')
+        df['price_m2_vs_neighbours'] = pd.array(price_m2 / neighbours_price_m2 - 1, dtype='Float64')
+    return df
+
+
+def spatial_features(df, pois=None, radius=500, k=5):
+    df = poi_distances(df, pois)
+    return neighbour_features(df, radius=radius, k=k)
@@ -0,0 +1,246 @@
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from logzero import logger
+from requests.adapters import HTTPAdapter
+
+from metrics_utils import count
+
+
+class AdaptiveRateLimiter:
+    # Seau à jetons par hôte : le débit est divisé par deux quand le serveur freine (429 / 503), puis remonte
+    # progressivement vers requests_per_second à chaque réponse réussie
+    def __init__(self, requests_per_second=None, burst=1, min_rate=0.5, recovery=0.05):
+        self.max_rate = requests_per_second or None
+        self.burst = burst
+        self.min_rate = min_rate
+        self.step = self.max_rate * recovery if self.max_rate else 0
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url, now):
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = {'rate': self.max_rate, 'tokens': self.burst, 'updated_at': now, 'paused_until': now}
+        return self.buckets[host]
+
+    def wait(self, url):
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.bucket(url, now)
+            delay = max(0, bucket['paused_until'] - now)
+            if bucket['rate']:
+                bucket['tokens'] = min(self.burst, bucket['tokens'] + (now - bucket['updated_at']) * bucket['rate'])
+                bucket['updated_at'] = now
+                # Le jeton est réservé tout de suite : un solde négatif fait patienter les threads suivants
+                bucket['tokens'] -= 1
+                delay = max(delay, -bucket['tokens'] / bucket['rate'])
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttle(self, url, pause=None):
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.bucket(url, now)
+            if bucket['rate']:
+                bucket['rate'] = max(self.min_rate, bucket['rate'] / 2)
+            if pause:
+                bucket['paused_until'] = max(bucket['paused_until'], now + pause)
+            return bucket['rate']
+
+    def relax(self, url):
+        if not self.step:
+            return
+        with self.lock:
+            bucket = self.bucket(url, time.monotonic())
+            bucket['rate'] = min(self.max_rate, bucket['rate'] + self.step)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    # Backoff exponentiel avec "full jitter" : un délai aléatoire entre 0 et base * 2 ** attempt
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_delay(response, cap=60.0):
+    # L'en-tête Retry-After donne soit un nombre de secondes, soit une date HTTP
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(cap, max(0.0, delay))
+
+
+class ApiClient(requests.Session):
+    # Session partagée par tous les appels : pools de connexions par hôte, limite de débit adaptative,
+    # nouvelles tentatives sur les erreurs temporaires et renouvellement du jeton sur une réponse 401
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    THROTTLE_STATUSES = {429, 503}
+
+    def __init__(self, pool_size=10, max_hosts=20, rate_limit=None, retries=3, backoff=1.0, response_hooks=()):
+        super().__init__()
+        # pool_connections : nombre d'hôtes dont les connexions sont gardées ouvertes, pool_maxsize : connexions
+        # gardées par hôte, assez pour que les requêtes concurrentes les réutilisent
+        for prefix in ('https://', 'http://'):
+            self.mount(prefix, HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size))
+        self.hooks['response'].extend(response_hooks)
+        self.limiter = AdaptiveRateLimiter(rate_limit)
+        self.retries = retries
+        self.backoff = backoff
+        self.login = None
+        # Hôte de l'API qui délivre le jeton : seul un 401 venant de lui le fait renouveler
+        self.auth_host = None
+        self.token_lock = threading.Lock()
+
+    def set_token(self, access_token):
+        self.headers['Authorization'] = f'Bearer {access_token}'
+
+    def refresh_token(self, failed_authorization):
+        with self.token_lock:
+            # Un autre thread a pu renouveler le jeton entre-temps
+            if self.headers.get('Authorization') != failed_authorization:
+                return True
+            access_token = self.login() if self.login is not None else None
+            if access_token is None:
+                return False
+            self.set_token(access_token)
+            logger.info('The access token has been renewed.')
+            return True
+
+    def request(self, method, url, *args, refresh=True, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(url)
+            authorization = self.headers.get('Authorization')
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = backoff_delay(attempt, base=self.backoff)
+                count('retries')
+                logger.warning(f'{method} {url} failed: {e}. Retrying in {delay:.1f} seconds.')
+                time.sleep(delay)
+                continue
+
+            # Un 401 d'un site d'annonces atteint par redirection est rendu tel quel, sans nouvelle connexion à l'API
+            if response.status_code == 401 and refresh and authorization and attempt < self.retries \
+                    and urlparse(response.url).netloc == self.auth_host:
+                response.close()
+                if not self.refresh_token(authorization):
+                    return response
+                count('retries')
+                continue
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                if response.status_code < 400:
+                    self.limiter.relax(url)
+                return response
+
+            response.close()
+            count('retries')
+            pause = retry_after_delay(response)
+            if response.status_code in self.THROTTLE_STATUSES:
+                # La pause demandée s'applique à tous les threads qui visent cet hôte, via le limiteur
+                rate = self.limiter.throttle(url, pause)
+                if rate:
+                    logger.warning(f'Throttled by {urlparse(url).netloc}, slowing down to {rate:.2f} requests/s.')
+            delay = pause if pause is not None else backoff_delay(attempt, base=self.backoff)
+            logger.warning(f'{method} {url} answered {response.status_code}. Retrying in {delay:.1f} seconds.')
+            if pause is None or response.status_code not in self.THROTTLE_STATUSES:
+                time.sleep(delay)
+
+
+class ResponseCache:
+    # Réponses gardées sur disque avec leurs validateurs (ETag / Last-Modified) pour les requêtes conditionnelles
+    def __init__(self, db_path, max_age=7 * 24 * 3600, max_bytes=100 * 1024 ** 2):
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                       url TEXT PRIMARY KEY,
+                                       alert_id TEXT,
+                                       etag TEXT,
+                                       last_modified TEXT,
+                                       body BLOB,
+                                       size INTEGER,
+                                       stored_at REAL,
+                                       used_at REAL)''')
+        self.connection.commit()
+        self.evict(max_age, max_bytes)
+
+    def get(self, url):
+        with self.lock:
+            return self.connection.execute('SELECT etag, last_modified, body FROM responses WHERE url = ?',
+                                           (url,)).fetchone()
+
+    def store(self, url, alert_id, response):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (url, None if alert_id is None else str(alert_id), response.headers.get('ETag'),
+                                     response.headers.get('Last-Modified'), response.content, len(response.content),
+                                     now, now))
+
+    def touch(self, url):
+        with self.lock, self.connection:
+            self.hits += 1
+            self.connection.execute('UPDATE responses SET used_at = ? WHERE url = ?', (time.time(), url))
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def evict(self, max_age, max_bytes):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM responses WHERE stored_at < ?', (time.time() - max_age,))
+            # Au-delà de la taille maximale, les réponses les moins récemment utilisées sont supprimées
+            rows = self.connection.execute('SELECT url, size FROM responses ORDER BY used_at DESC').fetchall()
+            total = 0
+            expired_urls = []
+            for url, size in rows:
+                total += size
+                if total > max_bytes:
+                    expired_urls.append((url,))
+            self.connection.executemany('DELETE FROM responses WHERE url = ?', expired_urls)
+
+    def close(self):
+        self.connection.close()
+
+
+def cached_get(session, url, headers=None, cache=None, alert_id=None):
+    if cache is None:
+        return session.get(url, headers=headers)
+
+    entry = cache.get(url)
+    request_headers = dict(headers or {})
+    if entry is not None:
+        etag, last_modified, _ = entry
+        if etag:
+            request_headers['If-None-Match'] = etag
+        if last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+
+    response = session.get(url, headers=request_headers)
+    if response.status_code == 304 and entry is not None:
+        # La page n'a pas changé : le corps est servi depuis le cache
+        cache.touch(url)
+        count('cache_hits')
+        response.status_code = 200
+        response._content = entry[2]
+        response.from_cache = True
+    else:
+        cache.miss()
+        if response.status_code == 200 and ('ETag' in response.headers or 'Last-Modified' in response.headers):
+            cache.store(url, alert_id, response)
+    return response
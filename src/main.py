@@ -1,15 +1,22 @@
 import json
 import argparse
 import os
-import warnings
-import re
+import sys
 
-import PySimpleGUI as sg
 from logzero import logger, logfile
 
-from api_utils import authenticate, get_alerts, get_all_apparts, get_all_links, remove_expired
-from processing_utils import features_engineering, cleaner, update_history_df, append_history_df
-from openpyxl.utils.exceptions import IllegalCharacterError
+# Seuls les modules légers sont importés au chargement : pandas, les modules du pipeline et PySimpleGUI ne le sont
+# qu'au moment où une exécution ou la fenêtre en ont besoin
+
+def point_of_interest(value):
+    # "Nom:lat,lng", par exemple "Travail:48.8698,2.3075"
+    name, _, coords = value.rpartition(':')
+    try:
+        lat, lng = (float(coord) for coord in coords.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value} is not of the form name:lat,lng')
+    return name, (lat, lng)
+
 
 parser = argparse.ArgumentParser(description='Override the GUI if needed.')
 # parser.add_argument('override', metavar='N', type=bool, nargs='+',
@@ -26,74 +33,347 @@ parser.add_argument('-x', '--expired', nargs='?', const=1,
                     help='Whether to remove expired offers.')
 parser.add_argument('-u', '--upload', nargs='?', const=1,
                     help='Whether to use the gsheets-uploader package to upload to Google Sheets.')
+parser.add_argument('-w', '--workers', type=int, default=4,
+                    help='Maximum number of dashboard pages fetched concurrently. 1 fetches them one by one.')
+parser.add_argument('-r', '--rate-limit', type=float, default=5.0,
+                    help='Maximum number of requests per second sent to a same host.')
+parser.add_argument('-a', '--alerts-display', choices=['compact', 'full', 'none'], default='compact',
+                    help='How the alerts are printed: one table, one block per alert, or not at all.')
+parser.add_argument('-c', '--checkpoint', type=int, default=50,
+                    help='Number of resolved links between two saves of the links database.')
+parser.add_argument('-P', '--processes', type=int, default=0,
+                    help='Number of processes parsing the pages checked for expiration. 0 parses them in the main process.')
+parser.add_argument('-n', '--no-cache', nargs='?', const=1,
+                    help='Whether to download every dashboard page again instead of using the HTTP cache.')
+parser.add_argument('-d', '--delta', nargs='?', const=1,
+                    help='Whether to stop paging each alert once a page only contains already known apparts.')
+parser.add_argument('-f', '--full-sync', nargs='?', const=1,
+                    help='Whether to force a full synchronisation of every page in delta mode.')
+parser.add_argument('--profile', nargs='?', const=1,
+                    help='Whether to dump a cProfile of the run to databases/run_profile.prof.')
+parser.add_argument('-L', '--light', nargs='?', const=1,
+                    help='Whether to drop the heavy description and images columns as soon as the ads are fetched.')
+parser.add_argument('-q', '--parquet', nargs='?', const=1,
+                    help='Whether to also export the apparts to data/apparts.parquet. It requires pyarrow.')
+parser.add_argument('-H', '--history-csv', nargs='?', const=1,
+                    help='Whether to export the whole history to data/history.csv.')
+parser.add_argument('-m', '--max-expired', type=int, default=15,
+                    help='Maximum number of expired offers reported in a single run. 0 removes the limit.')
+parser.add_argument('--dry-run', nargs='?', const=1,
+                    help='Whether to only log the expired offers which would be reported to Jinka.')
+parser.add_argument('-D', '--daemon', type=float, nargs='?', const=10,
+                    help='Whether to keep running headless and synchronise every given number of minutes (10 by default).')
+parser.add_argument('--status-port', type=int,
+                    help='Local port serving the status of the daemon, in addition to databases/status.json.')
+parser.add_argument('--no-xlsx', nargs='?', const=1,
+                    help='Whether to skip the export to data/apparts.xlsx.')
+parser.add_argument('--poi', type=point_of_interest, action='append', default=[],
+                    help='A point of interest given as name:lat,lng, whose distance to each appart is computed. '
+                         'Can be repeated.')
+parser.add_argument('--radius', type=int, default=500,
+                    help='Radius in meters of the neighbourhood used for the density and price per m2 comparisons.')
+parser.add_argument('-b', '--batch',
+                    help='A JSON file listing several accounts ([{"email": ..., "password": ..., "name": ...}]) which '
+                         'are synchronised in parallel, each in accounts/<name>, then merged in data/apparts_combined.csv.')
+parser.add_argument('--max-accounts', type=int, default=2,
+                    help='Maximum number of accounts synchronised at the same time in batch mode. The workers and '
+                         'rate-limit budgets are shared between them.')
+parser.add_argument('--price-report', nargs='?', const=1,
+                    help='Whether to export the rent drops to data/price_drops.csv and the monthly median rent per postal '
+                         'code to data/rent_trend.csv.')
+
+args = None
+argv = None
 
-args = parser.parse_args()
 
-current_dir = os.getcwd()
-path_list = current_dir.split(os.sep)
+class AuthenticationError(RuntimeError):
+    pass
 
-if path_list[-1] == 'src':
-    current_dir = os.path.join(current_dir, '..')
-    os.chdir(current_dir)
+# Lancée depuis src, l'application travaille dans le dossier parent ; KAJIN_ROOT la fait travailler ailleurs,
+# comme le fait le mode batch pour le dossier de chaque compte
+ROOT_PATH = os.environ.get('KAJIN_ROOT') or (
+    os.path.dirname(os.getcwd()) if os.path.basename(os.getcwd()) == 'src' else os.getcwd())
 
 # Path to files
 
-CREDENTIALS_FILE = os.path.join(os.getcwd(), 'databases', 'credentials.json')
-APPARTS_DB_PATH = os.path.join(os.getcwd(), 'databases', 'appart_links_db.json')
-LAST_DELETED_PATH = os.path.join(os.getcwd(), 'databases', 'last_deleted_apparts.json')
-HISTORY_PATH = os.path.join(os.getcwd(), 'data', 'history.csv')
-APPARTS_CSV_PATH = os.path.join(os.getcwd(), 'data', 'apparts.csv')
-APPARTS_XLSX_PATH = os.path.join(os.getcwd(), 'data', 'apparts.xlsx')
-LOG_PATH = os.path.join(os.getcwd(), 'databases', 'logs.log')
-DATABASES_PATH = os.path.join(os.getcwd(), 'databases')
-DATA_PATH = os.path.join(os.getcwd(), 'data')
-CREDS_PATH = os.path.join(os.getcwd(), '..', '..', 'gsheets_credentials')
+CREDENTIALS_FILE = os.path.join(ROOT_PATH, 'databases', 'credentials.json')
+APPARTS_DB_PATH = os.path.join(ROOT_PATH, 'databases', 'appart_links_db.json')
+LINKS_DB_PATH = os.path.join(ROOT_PATH, 'databases', 'links.db')
+SYNC_STATE_PATH = os.path.join(ROOT_PATH, 'databases', 'sync_state.json')
+FULL_SYNC_INTERVAL = 7 * 24 * 3600
+HTTP_CACHE_PATH = os.path.join(ROOT_PATH, 'databases', 'http_cache.db')
+HTTP_CACHE_MAX_AGE = 7 * 24 * 3600
+HTTP_CACHE_MAX_BYTES = 100 * 1024 ** 2
+FEATURE_CACHE_PATH = os.path.join(ROOT_PATH, 'databases', 'feature_cache.pkl')
+REPORTS_DB_PATH = os.path.join(ROOT_PATH, 'databases', 'reports.db')
+LAST_DELETED_PATH = os.path.join(ROOT_PATH, 'databases', 'last_deleted_apparts.json')
+HISTORY_PATH = os.path.join(ROOT_PATH, 'data', 'history.csv')
+HISTORY_DB_PATH = os.path.join(ROOT_PATH, 'data', 'history.db')
+PRICES_DB_PATH = os.path.join(ROOT_PATH, 'data', 'prices.db')
+PRICE_DROPS_PATH = os.path.join(ROOT_PATH, 'data', 'price_drops.csv')
+RENT_TREND_PATH = os.path.join(ROOT_PATH, 'data', 'rent_trend.csv')
+APPARTS_CSV_PATH = os.path.join(ROOT_PATH, 'data', 'apparts.csv')
+APPARTS_XLSX_PATH = os.path.join(ROOT_PATH, 'data', 'apparts.xlsx')
+APPARTS_PARQUET_PATH = os.path.join(ROOT_PATH, 'data', 'apparts.parquet')
+LOG_PATH = os.path.join(ROOT_PATH, 'databases', 'logs.log')
+RUN_REPORT_PATH = os.path.join(ROOT_PATH, 'databases', 'run_report.json')
+STATUS_PATH = os.path.join(ROOT_PATH, 'databases', 'status.json')
+BATCH_REPORT_PATH = os.path.join(ROOT_PATH, 'databases', 'batch_report.json')
+ACCOUNTS_PATH = os.path.join(ROOT_PATH, 'accounts')
+COMBINED_CSV_PATH = os.path.join(ROOT_PATH, 'data', 'apparts_combined.csv')
+COMBINED_XLSX_PATH = os.path.join(ROOT_PATH, 'data', 'apparts_combined.xlsx')
+COMBINED_PARQUET_PATH = os.path.join(ROOT_PATH, 'data', 'apparts_combined.parquet')
+RUN_PROFILE_PATH = os.path.join(ROOT_PATH, 'databases', 'run_profile.prof')
+DATABASES_PATH = os.path.join(ROOT_PATH, 'databases')
+DATA_PATH = os.path.join(ROOT_PATH, 'data')
+CREDS_PATH = os.path.join(ROOT_PATH, '..', '..', 'gsheets_credentials')
 TOKEN_FILE_PATH = os.path.join(CREDS_PATH, 'token.json')
 SECRET_CLIENT_PATH = os.path.join(CREDS_PATH, 'secret_client.json')
 EXPORT_CSV_PATH = APPARTS_CSV_PATH
 
-if os.path.exists(LOG_PATH):
-    os.remove(LOG_PATH)
 
-if not os.path.exists(DATABASES_PATH):
-    os.mkdir(DATABASES_PATH)
 
-if not os.path.exists(DATA_PATH):
-    os.mkdir(DATA_PATH)
+def parse_args(cli_argv=None):
+    global args, argv
+    argv = sys.argv[1:] if cli_argv is None else list(cli_argv)
+    args = parser.parse_args(argv)
+    return args
+
+
+def setup():
+    os.chdir(ROOT_PATH)
+
+    if os.path.exists(LOG_PATH):
+        os.remove(LOG_PATH)
+
+    if not os.path.exists(DATABASES_PATH):
+        os.mkdir(DATABASES_PATH)
+
+    if not os.path.exists(DATA_PATH):
+        os.mkdir(DATA_PATH)
+
+    logfile(LOG_PATH)
+
+
+class PipelineState:
+    # Session, cache HTTP et bases ouverts pour une exécution ; le mode daemon les garde d'une exécution à l'autre
+    def __init__(self, warm=False):
+        from storage_utils import LinkStore, HistoryStore, PriceStore, FeatureCache
+        from http_utils import ResponseCache
+
+        self.session = None
+        self.runs = 0
+        self.history_store = HistoryStore(HISTORY_DB_PATH, legacy_csv_path=HISTORY_PATH)
+        self.link_store = LinkStore(LINKS_DB_PATH, legacy_json_path=APPARTS_DB_PATH)
+        self.price_store = PriceStore(PRICES_DB_PATH, history_store=self.history_store)
+        self.report_store = None
+        self.feature_cache = FeatureCache(FEATURE_CACHE_PATH)
+        self.cache = None if args.no_cache else ResponseCache(HTTP_CACHE_PATH, HTTP_CACHE_MAX_AGE, HTTP_CACHE_MAX_BYTES)
+        if warm:
+            nb_ids = self.history_store.warm_index()
+            nb_links = self.link_store.warm_index()
+            nb_rents = self.price_store.warm_index()
+            logger.info(f'{nb_ids} known apparts, {nb_links} links and {nb_rents} rents are kept in memory.')
+
+    def close(self):
+        for store in (self.history_store, self.link_store, self.price_store, self.report_store, self.feature_cache,
+                      self.cache):
+            if store is not None:
+                store.close()
+        if self.session is not None:
+            self.session.close()
+
+
+def run_all(email, password, expired, workers=None, rate_limit=None, state=None):
+    import cProfile
+    from metrics_utils import start_run
+
+    workers = args.workers if workers is None else workers
+    rate_limit = args.rate_limit if rate_limit is None else rate_limit
+    metrics = start_run()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    run_state = state if state is not None else PipelineState()
+    try:
+        run_pipeline(email, password, expired, workers, rate_limit, metrics, run_state)
+    finally:
+        if state is None:
+            run_state.close()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(RUN_PROFILE_PATH)
+        metrics.write_report(RUN_REPORT_PATH)
+        logger.info(f'Run report written to {RUN_REPORT_PATH}.')
+    return metrics.report()
+
 
-logfile(LOG_PATH)
+def run_daemon(email, password, expired, interval):
+    from daemon_utils import StatusBoard, run_forever
 
-def run_all(email, password, expired):
-    s, headers = authenticate(email, password)
+    state = PipelineState(warm=True)
+    status_board = StatusBoard(STATUS_PATH, port=args.status_port, interval=interval)
+    logger.info(f'Daemon started, synchronising every {interval / 60:g} minutes.')
+    try:
+        run_forever(lambda: run_all(email, password, expired, state=state), interval, status_board)
+    finally:
+        state.close()
+
+
+def run_batch(accounts_path):
+    from batch_utils import load_accounts, strip_options, run_accounts, merge_datasets
+    from export_utils import export_apparts
+
+    accounts = load_accounts(accounts_path)
+    parallel = max(1, min(args.max_accounts, len(accounts)))
+    # Le budget de requêtes est partagé entre les comptes qui tournent en même temps
+    workers = max(1, args.workers // parallel)
+    rate_limit = args.rate_limit / parallel
+    logger.info(f'Synchronising {len(accounts)} accounts, {parallel} at a time with {workers} workers and '
+                f'{rate_limit:g} requests per second each.')
+    # Chaque compte relance main.py dans son dossier, avec les mêmes options et ses propres identifiants
+    command = [sys.executable, os.path.abspath(__file__),
+               *strip_options(argv, ['-b', '--batch', '--max-accounts', '-e', '--email', '-p', '--password']),
+               '-l', '1', '-w', str(workers), '-r', str(rate_limit)]
+    results = run_accounts(accounts, ACCOUNTS_PATH, command, parallel)
+
+    synchronised = [result['account'] for result in results if result['returncode'] == 0]
+    csv_paths = {}
+    for result in results:
+        csv_path = os.path.join(ACCOUNTS_PATH, result['account'], 'data', 'apparts.csv')
+        # L'export d'une exécution précédente n'est jamais fusionné, même si le compte a fini sans erreur
+        if result['returncode'] == 0 and os.path.exists(csv_path) and os.path.getmtime(csv_path) >= result['started_at']:
+            csv_paths[result['account']] = csv_path
+        elif result['returncode'] == 0:
+            logger.warning(f"Account {result['account']} did not export its apparts, it is left out of the merge.")
+    df_combined = merge_datasets(csv_paths)
+    if not df_combined.empty:
+        export_apparts(df_combined, COMBINED_CSV_PATH, None if args.no_xlsx else COMBINED_XLSX_PATH,
+                       parquet_path=COMBINED_PARQUET_PATH if args.parquet else None)
+    else:
+        logger.warning(f'No account exported its apparts, {COMBINED_CSV_PATH} is left as it is.')
+    with open(BATCH_REPORT_PATH, 'w') as f:
+        json.dump({'accounts': results, 'combined_apparts': len(df_combined)}, f, indent=2)
+    logger.info(f'{len(synchronised)}/{len(results)} accounts synchronised, {len(df_combined)} apparts combined.')
+    return results
+
+
+def run_pipeline(email, password, expired, workers, rate_limit, metrics, state):
+    import pandas as pd
+    from api_utils import authenticate, get_alerts, get_all_apparts, get_all_links, remove_expired, \
+        known_page_checker, apply_schema
+    from processing_utils import post_processing, update_history_df, append_history_df, new_expirations
+    from storage_utils import ReportStore, needs_full_sync, save_full_sync, last_full_sync
+    from metrics_utils import response_hook
+    from export_utils import export_apparts
+    from geo_utils import spatial_features
+    from price_utils import price_report
+
+    from datetime import datetime
+
+    warm_run = state.runs > 0
+    state.runs += 1
+    synced_at = datetime.now().isoformat(timespec='seconds')
+    with metrics.stage('authenticate'):
+        # Une session gardée d'une exécution précédente renouvelle elle-même son jeton
+        if state.session is None:
+            state.session = authenticate(email, password, pool_size=max(workers, 10), rate_limit=rate_limit,
+                                         response_hooks=[response_hook])
+        s = state.session
 
     if s is None:
-        logger.critical('Aborting search, check your credentials.')
-        quit()
-    df_alerts = get_alerts(s, headers)
-    df_apparts, expired_index = get_all_apparts(df_alerts, s, headers)
-    df_apparts = cleaner(df_apparts)
-    df_apparts = features_engineering(df_apparts)
-    df_history = append_history_df(df_apparts, HISTORY_PATH)
-    df_apparts = df_apparts.loc[~df_apparts.index.duplicated()]
-    df_apparts = get_all_links(s, df_apparts, expired, APPARTS_DB_PATH)
+        # Une exception plutôt que quit() : le daemon la journalise et continue, le mode ligne de commande sort en erreur
+        raise AuthenticationError('Aborting search, check your credentials.')
+    history_store = state.history_store
+    # Synchronisation complète sur demande, pour la première exécution, puis à intervalle régulier
+    # Un historique sans date de dernière vue (version précédente) demande lui aussi une synchronisation complète
+    delta = (args.delta or args.daemon) and not args.full_sync and history_store.count() > 0 \
+        and 'last_seen_at' in history_store.columns() and not needs_full_sync(SYNC_STATE_PATH, FULL_SYNC_INTERVAL)
+    is_known_page = known_page_checker(history_store.known_ids, history_store.newest_send_dates()) if delta else None
+
+    cache = state.cache
+    if cache is not None and warm_run:
+        cache.evict(HTTP_CACHE_MAX_AGE, HTTP_CACHE_MAX_BYTES)
+    with metrics.stage('get_alerts') as stage:
+        df_alerts = get_alerts(s, cache=cache, max_in_flight=workers, display=args.alerts_display)
+        stage['rows'] = len(df_alerts)
+    with metrics.stage('get_all_apparts') as stage:
+        df_apparts, expired_index = get_all_apparts(df_alerts, s, max_in_flight=workers, cache=cache,
+                                                    is_known_page=is_known_page, drop_heavy=args.light)
+        stage['rows'] = len(df_apparts)
+    with metrics.stage('price_history') as stage:
+        # Seuls les loyers qui ont changé depuis la dernière observation sont écrits
+        nb_rent_changes = state.price_store.record(df_apparts)
+        stage['rows'] = nb_rent_changes
+        logger.info(f'{nb_rent_changes} rent observations have been added to the price history.')
+    with metrics.stage('post_processing') as stage:
+        # cleaner et features_engineering ; les annonces dont les champs bruts n'ont pas changé reprennent les colonnes
+        # gardées lors d'une exécution précédente, et une synchronisation complète retire du cache les annonces absentes
+        df_apparts = post_processing(df_apparts, state.feature_cache, prune=not delta)
+        stage['rows'] = len(df_apparts)
+    with metrics.stage('append_history_df') as stage:
+        nb_known = history_store.count()
+        append_history_df(df_apparts, history_store)
+        # Les expirations données par Jinka aux annonces déjà connues sont écrites, même sans l'option expired
+        expired_now = new_expirations(df_apparts, history_store)
+        update_history_df(df_apparts, history_store, expired_now)
+        # Une synchronisation complète relit toutes les alertes : elle met aussi à jour les alertes de chaque annonce
+        history_store.mark_seen(df_apparts.index, synced_at,
+                                alert_ids=None if delta or 'alert_ids' not in df_apparts else df_apparts['alert_ids'])
+        stage['rows'] = len(df_apparts)
+        # Sans nouvelle annonce, ni loyer modifié, ni expiration depuis l'exécution précédente du daemon, les exports
+        # sont déjà à jour
+        if delta and warm_run and not expired and history_store.count() == nb_known and nb_rent_changes == 0 \
+                and expired_now.empty:
+            logger.info('No new apparts since the last synchronisation, the exports are left as they are.')
+            return
+        if delta:
+            # Les annonces des pages non relues sont reprises de l'historique, si leur alerte est toujours suivie et
+            # si Jinka les a rendues lors de la dernière synchronisation complète
+            # L'historique rend des booléens 0/1 et des dates en texte : ils retrouvent leurs types avant la concaténation
+            df_active = apply_schema(history_store.load_active(
+                exclude_ids=df_apparts.index, alert_ids=df_alerts['id'] if 'id' in df_alerts else [],
+                seen_since=last_full_sync(SYNC_STATE_PATH)))
+            if pd.api.types.is_integer_dtype(df_apparts.index):
+                df_active.index = df_active.index.astype(df_apparts.index.dtype)
+            df_apparts = apply_schema(pd.concat([df_apparts, df_active]))
+            logger.info(f'{len(df_active)} known apparts have been loaded from the history.')
+        elif df_alerts.empty:
+            # Sans alerte, la liste des annonces en ligne n'est pas connue : elle ne sert pas de référence au mode delta
+            logger.warning('No alert has been fetched, the full synchronisation is not recorded.')
+        else:
+            save_full_sync(SYNC_STATE_PATH, synced_at)
+        stage['rows'] = len(df_apparts)
+    with metrics.stage('spatial_features') as stage:
+        # Calculé sur toutes les annonces actives, y compris celles reprises de l'historique
+        df_apparts = spatial_features(df_apparts, pois=dict(args.poi), radius=args.radius)
+        stage['rows'] = len(df_apparts)
+    with metrics.stage('get_all_links') as stage:
+        df_apparts = get_all_links(s, df_apparts, expired, state.link_store, max_in_flight=workers,
+                                   checkpoint_every=args.checkpoint, processes=args.processes)
+        stage['rows'] = len(df_apparts)
     if expired:
-        df_history = update_history_df(df_apparts, df_history, expired_index)
-        df_apparts = remove_expired(s, df_apparts, LAST_DELETED_PATH)
-    df_apparts.to_csv(APPARTS_CSV_PATH, sep=';', encoding='utf-8')
-
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        try:
-            df_apparts.to_excel(APPARTS_XLSX_PATH)
-        except IllegalCharacterError:
-            logger.warning("Some illegal characters were replaced in the dataframe.")
-            ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
-            df_apparts_cleaned = df_apparts.applymap(
-                lambda x: ILLEGAL_CHARACTERS_RE.sub(r'', x) if isinstance(x, str) else x
-            )
-            df_apparts_cleaned.to_excel(APPARTS_XLSX_PATH)
-
-    df_history.to_csv(HISTORY_PATH, sep=';', encoding='utf-8')
+        with metrics.stage('remove_expired') as stage:
+            expired_index = df_apparts[df_apparts['expired_at'].notna()].index
+            update_history_df(df_apparts, history_store, expired_index)
+            if state.report_store is None:
+                state.report_store = ReportStore(REPORTS_DB_PATH)
+            df_apparts = remove_expired(s, df_apparts, LAST_DELETED_PATH, state.report_store, max_in_flight=workers,
+                                        max_expired=args.max_expired, dry_run=args.dry_run)
+            stage['rows'] = len(expired_index)
+
+    with metrics.stage('export') as stage:
+        export_apparts(df_apparts, APPARTS_CSV_PATH, None if args.no_xlsx else APPARTS_XLSX_PATH,
+                       parquet_path=APPARTS_PARQUET_PATH if args.parquet else None)
+
+        if args.history_csv:
+            history_store.export_csv(HISTORY_PATH)
+        if args.price_report:
+            df_drops, df_trend = price_report(state.price_store.load(),
+                                              history_store.load_columns(['postal_code', 'expired_at']))
+            df_drops.to_csv(PRICE_DROPS_PATH, sep=';', encoding='utf-8', index=False)
+            df_trend.to_csv(RENT_TREND_PATH, sep=';', encoding='utf-8', index=False)
+        stage['rows'] = len(df_apparts)
 
     if upload:
         uploader = Uploader(
@@ -110,6 +390,8 @@ def run_all(email, password, expired):
 
 
 def create_main_window(credentials_file=CREDENTIALS_FILE):
+    import PySimpleGUI as sg
+
     sg.theme()
     if os.path.exists(credentials_file):
         with open(credentials_file, 'r') as f:
@@ -137,10 +419,14 @@ def create_main_window(credentials_file=CREDENTIALS_FILE):
 
 
 if __name__ == '__main__':
+    parse_args()
+    setup()
 
     if (args.email == None) and (args.password == None) and (args.load == None) and (args.save == None) and (
             args.expired == None) \
-            and (args.upload == None):
+            and (args.upload == None) and (args.daemon == None) and (args.batch == None):
+        import PySimpleGUI as sg
+
         window = None
         while True:
             if window == None:
@@ -154,7 +440,11 @@ if __name__ == '__main__':
                 expired = credentials['-EXPIRED-']
                 upload = credentials['-UPLOAD-']
                 window.close()
-                run_all(email, password, expired=expired)
+                try:
+                    run_all(email, password, expired=expired)
+                except AuthenticationError as e:
+                    logger.critical(e)
+                    sys.exit(1)
                 break
 
             if event == 'Save credentials':
@@ -165,6 +455,10 @@ if __name__ == '__main__':
 
             if event in (sg.WIN_CLOSED, 'Exit'):
                 break
+    elif args.batch != None:
+        if args.daemon:
+            parser.error('--batch cannot be combined with --daemon.')
+        run_batch(args.batch)
     else:
         if args.load == True:
             if os.path.exists(CREDENTIALS_FILE):
@@ -182,4 +476,12 @@ if __name__ == '__main__':
             with open(CREDENTIALS_FILE, 'w') as f:
                 json.dump(credentials, f)
 
-        run_all(email, password, expired=args.expired)
\ No newline at end of file
+        upload = args.upload
+        if args.daemon:
+            run_daemon(email, password, expired=args.expired, interval=args.daemon * 60)
+        else:
+            try:
+                run_all(email, password, expired=args.expired)
+            except AuthenticationError as e:
+                logger.critical(e)
+                sys.exit(1)
\ No newline at end of file
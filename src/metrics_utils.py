@@ -0,0 +1,71 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+COUNTERS = ['requests', 'bytes', 'retries', 'cache_hits']
+
+
+class RunMetrics:
+    # Temps et compteurs de chaque étape d'une exécution, alimentés depuis n'importe quel thread
+    def __init__(self):
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+        self.stages = []
+        self.current = None
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        record = {'name': name, 'wall_time': 0.0, 'rows': None, **dict.fromkeys(COUNTERS, 0)}
+        with self.lock:
+            self.stages.append(record)
+            self.current = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_time'] = round(time.perf_counter() - start, 3)
+            with self.lock:
+                self.current = None
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.totals[counter] += value
+            if self.current is not None:
+                self.current[counter] += value
+
+    def response_hook(self, response, *args, **kwargs):
+        # Octets annoncés par le serveur : le corps des réponses en streaming n'est pas forcément lu
+        self.count('requests')
+        self.count('bytes', int(response.headers.get('Content-Length', 0)))
+
+    def report(self):
+        return {'started_at': self.started_at, 'wall_time': round(time.perf_counter() - self.start, 3),
+                'totals': self.totals, 'stages': self.stages}
+
+    def write_report(self, report_path):
+        with open(report_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+current_run = None
+
+
+def start_run():
+    global current_run
+    current_run = RunMetrics()
+    return current_run
+
+
+def count(counter, value=1):
+    if current_run is not None:
+        current_run.count(counter, value)
+
+
+def response_hook(response, *args, **kwargs):
+    # Rattaché à la session une seule fois : les réponses sont comptées dans l'exécution en cours
+    if current_run is not None:
+        current_run.response_hook(response, *args, **kwargs)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+def expired_dates(expired_at):
+    expired_at = pd.Series(expired_at)
+    expired_at.index = expired_at.index.astype(str)
+    return pd.to_datetime(expired_at, errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None)
+
+
+def epoch_seconds(date):
+    return (pd.Timestamp(date) - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+
+
+def price_changes(df_prices):
+    # df_prices : observations (id, observed_at, rent) triées par annonce puis par date, comme les rend PriceStore.load
+    ids = df_prices['id'].to_numpy()
+    rents = df_prices['rent'].to_numpy(dtype=float)
+    same_appart = np.zeros(len(df_prices), dtype=bool)
+    same_appart[1:] = ids[1:] == ids[:-1]
+    previous_rents = np.full(len(df_prices), np.nan)
+    previous_rents[1:] = rents[:-1]
+    df_changes = df_prices.loc[same_appart].copy()
+    df_changes['previous_rent'] = previous_rents[same_appart]
+    df_changes['change'] = df_changes['rent'] - df_changes['previous_rent']
+    df_changes['change_pct'] = df_changes['change'] / df_changes['previous_rent']
+    return df_changes
+
+
+def price_drops(df_prices, since=None, min_drop_pct=0.0):
+    # Baisses de loyer, éventuellement depuis une date et d'au moins min_drop_pct (0.05 pour 5 %)
+    df_changes = price_changes(df_prices)
+    drops = df_changes['change_pct'] < -min_drop_pct
+    if since is not None:
+        drops &= df_changes['observed_at'] >= pd.Timestamp(since)
+    return df_changes.loc[drops]
+
+
+def time_on_market(df_prices, expired_at=None, now=None):
+    # Jours entre la première observation d'une annonce et son expiration, ou maintenant si elle est encore en ligne
+    now = pd.Timestamp.now(tz='UTC').tz_localize(None) if now is None else pd.Timestamp(now)
+    first_seen = df_prices.groupby('id', sort=False)['observed_at'].min()
+    end = pd.Series(now, index=first_seen.index)
+    if expired_at is not None:
+        end = expired_dates(expired_at).reindex(first_seen.index).fillna(end)
+    return ((end - first_seen) / pd.Timedelta(days=1)).rename('days_on_market')
+
+
+def rent_trend(df_prices, postal_codes, freq='MS', expired_at=None, now=None):
+    # Loyer médian des annonces en ligne au début de chaque période, par code postal
+    now = pd.Timestamp.now(tz='UTC').tz_localize(None) if now is None else pd.Timestamp(now)
+    columns = ['postal_code', 'period', 'median_rent', 'apparts', 'change_pct']
+    if df_prices.empty:
+        return pd.DataFrame(columns=columns)
+    # Les ids texte sont remplacés une fois pour toutes par des entiers, bien plus rapides à trier et à comparer
+    codes, ids = pd.factorize(df_prices['id'])
+    seconds = (df_prices['observed_at'].to_numpy(dtype='datetime64[s]') - np.datetime64(0, 's')).astype(np.int64)
+    first_seen = np.full(len(ids), np.iinfo(np.int64).max)
+    np.minimum.at(first_seen, codes, seconds)
+    end = np.full(len(ids), epoch_seconds(now))
+    if expired_at is not None:
+        expired = expired_dates(expired_at).reindex(ids)
+        end = np.where(expired.isna(), end, (expired.fillna(now) - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+    periods = pd.date_range(pd.Timestamp(first_seen.min(), unit='s').normalize(), now, freq=freq)
+    period_seconds = (periods.to_numpy(dtype='datetime64[s]') - np.datetime64(0, 's')).astype(np.int64)
+
+    # Une paire (annonce, période) pour chaque période où l'annonce est en ligne, sans boucle sur les annonces
+    starts = np.searchsorted(period_seconds, first_seen)
+    counts = np.maximum(np.searchsorted(period_seconds, end) - starts, 0)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    grid_codes = np.repeat(np.arange(len(ids)), counts)
+    grid_periods = np.repeat(starts, counts) + offsets
+
+    # Le loyer de chaque paire est celui de la dernière observation de l'annonce avant la période : une seule
+    # recherche dichotomique sur la clé (annonce, date) triée, comme les cellules de geo_utils.GridIndex
+    keys = codes.astype(np.int64) * 2 ** 32 + seconds
+    order = np.argsort(keys, kind='stable')
+    positions = np.searchsorted(keys[order], grid_codes * 2 ** 32 + period_seconds[grid_periods], side='right') - 1
+    rents = df_prices['rent'].to_numpy(dtype=float)[order][positions]
+    postal_codes = pd.Series(postal_codes)
+    postal_codes.index = postal_codes.index.astype(str)
+    df_grid = pd.DataFrame({'postal_code': postal_codes.reindex(ids).to_numpy()[grid_codes],
+                            'period': periods[grid_periods], 'rent': rents})
+    df_trend = (df_grid.dropna(subset=['postal_code', 'rent'])
+                .groupby(['postal_code', 'period'], observed=True)['rent']
+                .agg(median_rent='median', apparts='count')
+                .reset_index())
+    df_trend['change_pct'] = df_trend.groupby('postal_code', observed=True)['median_rent'].pct_change()
+    return df_trend[columns]
+
+
+def price_report(df_prices, df_history, since=None, freq='MS', now=None):
+    # Baisses de loyer avec la durée de mise en ligne de chaque annonce, et évolution des loyers par code postal
+    expired_at = df_history['expired_at'] if 'expired_at' in df_history else None
+    df_drops = price_drops(df_prices, since=since)
+    days_on_market = time_on_market(df_prices, expired_at=expired_at, now=now)
+    df_drops = df_drops.assign(days_on_market=days_on_market.reindex(df_drops['id']).to_numpy())
+    df_trend = rent_trend(df_prices, df_history['postal_code'], freq=freq, expired_at=expired_at, now=now) \
+        if 'postal_code' in df_history else pd.DataFrame()
+    return df_drops, df_trend
@@ -1,49 +1,123 @@
-import os
-import itertools
+import marshal
+import zlib
+
+import numpy as np
 import pandas as pd
+from logzero import logger
 
-def metro_extractor(metro_ls):
-    stops_names = [x['name'] for x in metro_ls]
-    lines_names = [x['lines'] for x in metro_ls]
-    lines_names = set(itertools.chain.from_iterable(lines_names))
-    return [stops_names, lines_names]
+# Champs bruts dont dépendent les colonnes gardées par FeatureCache ; price_m2 et rent_evolution, calculés sur des
+# colonnes entières, sont toujours recalculés
+HASHED_SCALARS = ['lat', 'lng']
+HASHED_NESTED = ['features', 'stops']
 
-def cleaner(df, columns=['source_logo', 'source_label', 'search_type',
- 'rent_max', 'bedroom', 'buy_type', 'new_real_estate', 'webview_link', 'source_description']):
+def natural_key(line):
+    return len(line), line
+
+def values_hash(values):
+    # marshal est bien plus rapide que repr ou json, et stable d'une exécution à l'autre
+    try:
+        return zlib.crc32(marshal.dumps(values))
+    except ValueError:
+        return zlib.crc32(repr(values).encode())
+
+def nested_hash(ad):
+    # Empreinte des champs imbriqués d'une annonce brute, calculée une seule fois à la lecture de sa page
+    return values_hash(tuple(ad.get(column) for column in HASHED_NESTED))
+
+def content_hashes(df):
+    # Les scalaires sont hachés en un seul appel vectorisé, avec l'empreinte des champs imbriqués de chaque annonce
+    if 'nested_hash' in df:
+        nested = df['nested_hash'].fillna(0).astype('uint32').to_numpy()
+    else:
+        nested = np.array([values_hash(values) for values in zip(*(df[column] for column in HASHED_NESTED))],
+                          dtype='uint32')
+    df_hashed = df[HASHED_SCALARS].assign(nested_hash=nested)
+    return pd.util.hash_pandas_object(df_hashed, index=False).to_numpy().view('int64')
 
-    df['features'] = df['features'].apply(lambda x: {} if pd.isna(x) else x)
-    df_extract = pd.json_normalize(df['features'])
-    df = df.merge(df_extract, how='left', on='id')
+def flatten_features_and_stops(features, stops):
+    # Un seul passage sur les enregistrements bruts, sans apply ni merge
+    feature_records = []
+    metro_stations = []
+    metro_lines = []
+    for feature, stops_ls in zip(features, stops):
+        feature_records.append(feature if isinstance(feature, dict) else {})
+        if not isinstance(stops_ls, list):
+            stops_ls = []
+        metro_stations.append(', '.join(stop['name'] for stop in stops_ls))
+        lines = {line for stop in stops_ls for line in stop['lines']}
+        metro_lines.append(', '.join(sorted(lines, key=natural_key)))
+    return feature_records, metro_stations, metro_lines
 
-    metro_res = df['stops'].apply(lambda x: metro_extractor(x))
-    df[['metro_stations', 'metro_lines']] = pd.DataFrame(metro_res.tolist(), index=df.index)
+def extract_features(df):
+    # Colonnes tirées de features et stops, les plus coûteuses de cleaner
+    feature_records, metro_stations, metro_lines = flatten_features_and_stops(df['features'], df['stops'])
+    df_extract = pd.DataFrame.from_records(feature_records, index=df.index)
+    df_extract = df_extract.rename(columns={column: column + '_feature'
+                                            for column in df_extract.columns.intersection(df.columns)})
 
-    columns_to_drop = columns + ['year', 'box', 'stops', 'features']
-    df = df.drop(columns=columns_to_drop)
+    # Peu de combinaisons distinctes de stations et de lignes : des catégories suffisent
+    df_extract['metro_stations'] = pd.Categorical(metro_stations)
+    df_extract['metro_lines'] = pd.Categorical(metro_lines)
+    return df_extract
+
+def cleaner(df, columns=['source_logo', 'source_label', 'search_type',
+ 'rent_max', 'bedroom', 'buy_type', 'new_real_estate', 'webview_link', 'source_description'], df_extract=None):
+
+    # df_extract : résultat de extract_features déjà connu, par exemple repris du cache
+    df_extract = extract_features(df) if df_extract is None else df_extract
+    df = pd.concat([df, df_extract], axis=1)
+
+    columns_to_drop = columns + ['year', 'box', 'stops', 'features', 'nested_hash']
+    df = df.drop(columns=columns_to_drop, errors='ignore')
     return df
 
-def features_engineering(df):
+def geo_coords(lat, lng):
+    return lat.astype('string') + ', ' + lng.astype('string')
+
+def features_engineering(df, coords=None):
     df['price_m2'] = df['rent'] / df['area']
     df['rent_evolution'] = df['previous_rent'] - df['rent']
-    df['geo_coords'] = df['lat'].astype('string') + ', ' + df['lng'].astype('string')
-    df = df.drop(columns=['previous_rent', 'lat', 'lng'])
+    df['geo_coords'] = geo_coords(df['lat'], df['lng']) if coords is None else coords
+    # lat et lng restent numériques pour les calculs de distance de geo_utils
+    df = df.drop(columns=['previous_rent'])
     return df
 
-def append_history_df(df, history_path, sep=';'):
-    if os.path.exists(history_path):
-        df_history = pd.read_csv(history_path, encoding='utf-8', sep=sep, index_col=['id'])
-    else:
-        df_history = pd.DataFrame(columns=df.columns).rename_axis(index='id')
+def post_processing(df, feature_cache=None, prune=False):
+    # cleaner puis features_engineering ; avec un cache, seules les annonces nouvelles ou dont les champs bruts ont
+    # changé passent par extract_features et geo_coords, les autres reprennent les colonnes d'une exécution précédente
+    # prune : synchronisation complète, le cache ne garde que les annonces de df
+    if feature_cache is None or df.empty:
+        return features_engineering(cleaner(df))
+    hashes = content_hashes(df)
+    df_cached, cached = feature_cache.lookup(df.index, hashes)
+    df_fresh = df.loc[~cached]
+    df_derived = extract_features(df_fresh)
+    df_derived['geo_coords'] = geo_coords(df_fresh['lat'], df_fresh['lng'])
+    # Une partie vide fausserait les types de la concaténation
+    df_derived = pd.concat([frame for frame in (df_cached, df_derived) if not frame.empty]).reindex(df.index)
+    # Les catégories du cache et celles des nouvelles annonces diffèrent : elles sont recalculées sur l'ensemble
+    for column in ['metro_stations', 'metro_lines']:
+        df_derived[column] = pd.Categorical(df_derived[column].astype(str))
+    feature_cache.save(df_derived, hashes, prune=prune)
+    logger.info(f'{cached.sum()} apparts taken from the feature cache, {len(df_fresh)} post-processed.')
 
-    new_entries = list(set(df.index) - set(df_history.index))
-    df_to_append = df.loc[new_entries, :]
+    df = cleaner(df, df_extract=df_derived.drop(columns='geo_coords'))
+    return features_engineering(df, coords=df_derived['geo_coords'])
 
-    df_history = pd.concat([df_history, df_to_append])
+def append_history_df(df, history_store):
+    nb_new_entries = history_store.append(df)
+    logger.info(f'{nb_new_entries} new apparts have been added to the history.')
+    return history_store
 
-    return df_history
+def new_expirations(df, history_store):
+    # Annonces relues que Jinka donne pour expirées alors que l'historique les croit encore en ligne
+    if 'expired_at' not in df:
+        return df.index[:0]
+    df_expired = df.loc[df['expired_at'].notna()]
+    known = history_store.expired_ids(df_expired.index)
+    return df_expired.index[[str(appart_id) not in known for appart_id in df_expired.index]]
 
-def update_history_df(df, df_history, expired_index):
-    index_to_update = set(df.index).intersection(set(expired_index))
-    updated_entries = df.loc[index_to_update, :]
-    df_history.loc[index_to_update, 'expired_at'] = updated_entries['expired_at']
-    return df_history
\ No newline at end of file
+def update_history_df(df, history_store, expired_index):
+    index_to_update = list(set(df.index).intersection(set(expired_index)))
+    history_store.update_expired(df.loc[index_to_update, 'expired_at'])
+    return history_store
\ No newline at end of file
@@ -0,0 +1,419 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from logzero import logger
+
+SQLITE_MAX_PARAMS = 500
+
+
+def chunks(values, size=SQLITE_MAX_PARAMS):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class LinkStore:
+    # Cache des liens résolus, indexé par id d'annonce : seules les annonces demandées sont lues ou écrites
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS links (
+                                       id TEXT PRIMARY KEY,
+                                       alert_id TEXT,
+                                       link TEXT,
+                                       status TEXT,
+                                       resolved_at TEXT)''')
+        self.connection.commit()
+        self.links = None
+        if legacy_json_path is not None and os.path.exists(legacy_json_path) and self.count() == 0:
+            self.migrate_json(legacy_json_path)
+
+    def warm_index(self):
+        # Pour un processus qui dure (mode daemon) : tous les liens sont gardés en mémoire et tenus à jour
+        self.links = dict(self.connection.execute('SELECT id, link FROM links').fetchall())
+        return len(self.links)
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM links').fetchone()[0]
+
+    def migrate_json(self, legacy_json_path):
+        logger.info(f'Migrating the links database {legacy_json_path} to {self.db_path}.')
+        with open(legacy_json_path, 'r') as f:
+            links = json.load(f).get('link', {})
+        self.save_links({appart_id: (None, link) for appart_id, link in links.items()})
+        # L'ancien fichier est conservé à côté, mais n'est plus relu
+        os.replace(legacy_json_path, legacy_json_path + '.bak')
+        logger.info(f'Migrated {len(links)} links.')
+
+    def get_links(self, ids):
+        if self.links is not None:
+            return {str(appart_id): self.links[str(appart_id)] for appart_id in ids if str(appart_id) in self.links}
+        links = {}
+        for chunk in chunks(str(appart_id) for appart_id in ids):
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT id, link FROM links WHERE id IN ({placeholders})', chunk)
+            links.update(rows.fetchall())
+        return links
+
+    def save_links(self, links):
+        # links : {id: (alert_id, link)}
+        resolved_at = datetime.now().isoformat(timespec='seconds')
+        rows = [(str(appart_id), alert_id, link, 'invalid' if link in (None, 'Invalid link') else 'valid', resolved_at)
+                for appart_id, (alert_id, link) in links.items()]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO links (id, alert_id, link, status, resolved_at) '
+                                        'VALUES (?, ?, ?, ?, ?)', rows)
+        if self.links is not None:
+            self.links.update((row[0], row[2]) for row in rows)
+
+    def close(self):
+        self.connection.close()
+
+
+class HistoryStore:
+    # Historique de toutes les annonces vues : seules les nouvelles annonces et les dates d'expiration sont écrites
+    def __init__(self, db_path, legacy_csv_path=None, sep=';'):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS history (id TEXT PRIMARY KEY)')
+        self.connection.commit()
+        self.ids = None
+        if legacy_csv_path is not None and os.path.exists(legacy_csv_path) and self.count() == 0:
+            logger.info(f'Migrating the history {legacy_csv_path} to {self.db_path}.')
+            self.append(pd.read_csv(legacy_csv_path, encoding='utf-8', sep=sep, index_col=['id']))
+
+    def count(self):
+        if self.ids is not None:
+            return len(self.ids)
+        return self.connection.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+
+    def warm_index(self):
+        # Pour un processus qui dure (mode daemon) : les ids connus sont gardés en mémoire et tenus à jour
+        self.ids = {row[0] for row in self.connection.execute('SELECT id FROM history')}
+        return len(self.ids)
+
+    def columns(self):
+        return [row[1] for row in self.connection.execute('PRAGMA table_info(history)')]
+
+    def known_ids(self, ids):
+        if self.ids is not None:
+            return {str(appart_id) for appart_id in ids} & self.ids
+        known = set()
+        for chunk in chunks(str(appart_id) for appart_id in ids):
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT id FROM history WHERE id IN ({placeholders})', chunk)
+            known.update(row[0] for row in rows)
+        return known
+
+    def append(self, df):
+        df = df.loc[~df.index.duplicated()]
+        known = self.known_ids(df.index)
+        df_new = df.loc[[str(appart_id) not in known for appart_id in df.index]].copy()
+        if df_new.empty:
+            return 0
+
+        # Les listes et dictionnaires sont stockés sous leur représentation texte, comme dans l'ancien CSV
+        for column in df_new.columns[df_new.dtypes == object]:
+            df_new[column] = df_new[column].map(
+                lambda x: str(x) if isinstance(x, (list, dict, set, tuple)) else x)
+
+        existing_columns = set(self.columns())
+        with self.connection:
+            for column in df_new.columns:
+                if column not in existing_columns:
+                    self.connection.execute(f'ALTER TABLE history ADD COLUMN "{column}"')
+        df_new.to_sql('history', self.connection, if_exists='append', index=True, index_label='id')
+        if self.ids is not None:
+            self.ids.update(str(appart_id) for appart_id in df_new.index)
+        return len(df_new)
+
+    def update_expired(self, expired_at):
+        # expired_at : Series indexée par id d'annonce
+        if 'expired_at' not in self.columns():
+            return 0
+        rows = [(None if pd.isna(date) else str(date), str(appart_id)) for appart_id, date in expired_at.items()]
+        with self.connection:
+            self.connection.executemany('UPDATE history SET expired_at = ? WHERE id = ?', rows)
+        return len(rows)
+
+    def expired_ids(self, ids):
+        # Ids dont la date d'expiration est déjà écrite dans l'historique
+        if 'expired_at' not in self.columns():
+            return set()
+        expired = set()
+        for chunk in chunks(str(appart_id) for appart_id in ids):
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f'SELECT id FROM history WHERE expired_at IS NOT NULL AND id IN ({placeholders})', chunk)
+            expired.update(row[0] for row in rows)
+        return expired
+
+    def newest_send_dates(self):
+        # Date d'envoi la plus récente déjà connue pour chaque alerte
+        if not {'alert_id', 'sendDate'}.issubset(self.columns()):
+            return {}
+        rows = self.connection.execute('SELECT alert_id, MAX(sendDate) FROM history GROUP BY alert_id')
+        return {str(alert_id): send_date for alert_id, send_date in rows if send_date is not None}
+
+    def mark_seen(self, ids, seen_at, alert_ids=None):
+        # Date de la dernière synchronisation où chaque annonce a été rendue par Jinka ; une synchronisation complète
+        # donne aussi la liste à jour de ses alertes (Series indexée par id d'annonce)
+        columns = self.columns()
+        with self.connection:
+            for column in ('last_seen_at', 'alert_ids'):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE history ADD COLUMN {column} TEXT')
+        ids = list(dict.fromkeys(str(appart_id) for appart_id in ids))
+        with self.connection:
+            if alert_ids is None:
+                self.connection.executemany('UPDATE history SET last_seen_at = ? WHERE id = ?',
+                                            [(seen_at, appart_id) for appart_id in ids])
+            else:
+                alert_ids = pd.Series(alert_ids)
+                alert_ids = dict(zip(alert_ids.index.astype(str), alert_ids))
+                self.connection.executemany('UPDATE history SET last_seen_at = ?, alert_ids = ? WHERE id = ?',
+                                            [(seen_at, alert_ids.get(appart_id), appart_id) for appart_id in ids])
+        return len(ids)
+
+    def load_active(self, exclude_ids=(), alert_ids=None, seen_since=None):
+        # Annonces sans date d'expiration, éventuellement limitées aux alertes encore suivies et aux annonces
+        # rendues par Jinka depuis seen_since (la dernière synchronisation complète)
+        columns = self.columns()
+        if 'expired_at' not in columns:
+            return pd.DataFrame()
+        query, params = 'SELECT * FROM history WHERE expired_at IS NULL', []
+        if seen_since is not None and 'last_seen_at' in columns:
+            query += ' AND last_seen_at >= ?'
+            params.append(seen_since)
+        df_active = pd.read_sql(query, self.connection, index_col='id', params=params)
+        exclude_ids = {str(appart_id) for appart_id in exclude_ids}
+        keep = [appart_id not in exclude_ids for appart_id in df_active.index]
+        if alert_ids is not None:
+            alert_ids = {str(alert_id) for alert_id in alert_ids}
+            alert_column = 'alert_ids' if 'alert_ids' in df_active else 'alert_id'
+            appart_alerts = df_active[alert_column] if alert_column in df_active \
+                else pd.Series(None, index=df_active.index, dtype=object)
+            keep = [kept and not pd.isna(alerts) and not alert_ids.isdisjoint(str(alerts).split(', '))
+                    for kept, alerts in zip(keep, appart_alerts)]
+        return df_active.loc[keep].drop(columns='last_seen_at', errors='ignore')
+
+    def load_columns(self, columns):
+        columns = [column for column in columns if column in self.columns()]
+        selected = ''.join(f', "{column}"' for column in columns)
+        return pd.read_sql(f'SELECT id{selected} FROM history', self.connection, index_col='id')
+
+    def export_csv(self, csv_path, sep=';'):
+        df_history = pd.read_sql('SELECT * FROM history', self.connection, index_col='id')
+        df_history.to_csv(csv_path, sep=sep, encoding='utf-8')
+        return df_history
+
+    def close(self):
+        self.connection.close()
+
+
+class FeatureCache:
+    # Colonnes calculées par le post-traitement pour chaque annonce, avec l'empreinte des champs bruts dont elles
+    # viennent. Un instantané en colonnes (pickle) plutôt qu'une table SQLite : relire 50 000 lignes une à une coûte
+    # autant que de les recalculer, l'instantané se relit en quelques millisecondes
+    def __init__(self, path):
+        self.path = path
+        self.df = None
+
+    def load(self):
+        if self.df is None:
+            self.df = pd.DataFrame({'content_hash': pd.Series(dtype='int64')}, index=pd.Index([], dtype=object))
+            if os.path.exists(self.path):
+                try:
+                    self.df = pd.read_pickle(self.path)
+                except Exception as e:
+                    logger.warning(f'The feature cache {self.path} could not be read ({e}), it will be rebuilt.')
+        return self.df
+
+    def count(self):
+        return len(self.load())
+
+    def lookup(self, ids, hashes):
+        # Seules les lignes des ids demandés dont l'empreinte n'a pas changé sont reprises, avec leurs types
+        df_cache = self.load()
+        ids = pd.Index(ids)
+        positions = df_cache.index.get_indexer(ids.astype(str))
+        cached = positions >= 0
+        cached[cached] = df_cache['content_hash'].to_numpy()[positions[cached]] == hashes[cached]
+        df_cached = df_cache.iloc[positions[cached]].drop(columns='content_hash')
+        df_cached.index = ids[cached]
+        return df_cached, cached
+
+    def save(self, df_derived, hashes, prune=False):
+        # prune : après une synchronisation complète, les annonces qui ne sont plus en ligne quittent le cache
+        df_rows = df_derived.assign(content_hash=hashes)
+        df_rows.index = df_rows.index.astype(str)
+        df_cache = self.load()
+        if not prune and not df_cache.empty:
+            # get_indexer plutôt que isin, bien plus lent sur un index de textes
+            df_rows = pd.concat([df_cache.loc[df_rows.index.get_indexer(df_cache.index) < 0], df_rows])
+        self.df = df_rows
+        df_rows.to_pickle(self.path + '.tmp')
+        os.replace(self.path + '.tmp', self.path)
+        return len(df_rows)
+
+    def close(self):
+        self.df = None
+
+
+def to_epoch(values, default):
+    # Secondes depuis 1970 en UTC, les dates manquantes ou invalides prennent la valeur default
+    dates = pd.to_datetime(pd.Series(values), errors='coerce', utc=True, format='ISO8601').dt.tz_localize(None)
+    return ((dates.fillna(default) - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype='int64')
+
+
+class PriceStore:
+    # Série temporelle des loyers : une ligne (id, date, loyer) n'est écrite que lorsque le loyer d'une annonce change
+    def __init__(self, db_path, history_store=None):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        # Sans rowid, les lignes sont rangées par (id, date) : l'historique d'une annonce est contigu sur le disque
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS prices (
+                                       id TEXT,
+                                       observed_at INTEGER,
+                                       rent REAL,
+                                       PRIMARY KEY (id, observed_at)) WITHOUT ROWID''')
+        self.connection.commit()
+        self.last_rents = None
+        if history_store is not None and self.count() == 0 and history_store.count() > 0:
+            logger.info(f'Initialising the rent time series {self.db_path} from the history.')
+            self.record(history_store.load_columns(['rent', 'previous_rent', 'previous_rent_at', 'created_at']))
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM prices').fetchone()[0]
+
+    def warm_index(self):
+        # Pour un processus qui dure (mode daemon) : le dernier loyer de chaque annonce est gardé en mémoire
+        self.last_rents = self.latest_rents()
+        return len(self.last_rents)
+
+    def latest_rents(self, ids=None):
+        # Avec MAX, SQLite rend les autres colonnes de la ligne où le maximum est atteint
+        query = 'SELECT id, MAX(observed_at), rent FROM prices'
+        if ids is None:
+            rows = self.connection.execute(query + ' GROUP BY id').fetchall()
+        else:
+            rows = []
+            for chunk in chunks(str(appart_id) for appart_id in ids):
+                placeholders = ', '.join('?' * len(chunk))
+                rows += self.connection.execute(f'{query} WHERE id IN ({placeholders}) GROUP BY id', chunk).fetchall()
+        return {row[0]: row[2] for row in rows}
+
+    def record(self, df, observed_at=None):
+        # df : annonces indexées par id, avec rent et si possible previous_rent, previous_rent_at et created_at
+        observed_at = pd.Timestamp.now(tz='UTC').tz_localize(None) if observed_at is None else pd.Timestamp(observed_at)
+        df = df.loc[~df.index.duplicated()]
+        ids = df.index.astype(str).to_numpy()
+        rents = pd.to_numeric(df['rent'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        last_rents = self.last_rents if self.last_rents is not None else self.latest_rents(ids)
+        last = np.array([last_rents.get(appart_id, np.nan) for appart_id in ids], dtype=float)
+        priced = ~np.isnan(rents)
+        new = priced & np.isnan(last)
+        changed = priced & ~new & (rents != last)
+
+        def column(name):
+            # Les dates et anciens loyers ne sont lus que pour les nouvelles annonces
+            return df[name].loc[new] if name in df else pd.Series(None, index=df.index[new], dtype=object)
+
+        now = int((observed_at - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+        new_ids, new_rents = ids[new], rents[new]
+        created_at = to_epoch(column('created_at'), observed_at)
+        changed_at = to_epoch(column('previous_rent_at'), observed_at)
+        previous_rents = pd.to_numeric(column('previous_rent'), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        # Une nouvelle annonce dont le loyer a déjà baissé commence par son ancien loyer, à sa date de création
+        seeded = ~np.isnan(previous_rents) & (previous_rents != new_rents)
+        observations = [
+            (new_ids[seeded], created_at[seeded], previous_rents[seeded]),
+            (new_ids[~seeded], created_at[~seeded], new_rents[~seeded]),
+            (new_ids[seeded], np.maximum(changed_at[seeded], created_at[seeded] + 1), new_rents[seeded]),
+            (ids[changed], np.full(changed.sum(), now), rents[changed]),
+        ]
+        rows = [(appart_id, int(timestamp), float(rent))
+                for group_ids, timestamps, group_rents in observations
+                for appart_id, timestamp, rent in zip(group_ids, timestamps, group_rents)]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO prices (id, observed_at, rent) VALUES (?, ?, ?)', rows)
+        if self.last_rents is not None:
+            self.last_rents.update(zip(ids[priced], rents[priced].tolist()))
+        return len(rows)
+
+    def load(self, ids=None):
+        # Toutes les observations, triées par annonce puis par date
+        query = 'SELECT id, observed_at, rent FROM prices'
+        if ids is None:
+            df_prices = pd.read_sql(query + ' ORDER BY id, observed_at', self.connection)
+        else:
+            frames = [pd.read_sql(f"{query} WHERE id IN ({', '.join('?' * len(chunk))}) ORDER BY id, observed_at",
+                                  self.connection, params=chunk)
+                      for chunk in chunks(str(appart_id) for appart_id in ids)]
+            df_prices = pd.concat(frames, ignore_index=True) if frames \
+                else pd.DataFrame(columns=['id', 'observed_at', 'rent'])
+        df_prices['observed_at'] = pd.to_datetime(df_prices['observed_at'].astype('int64'), unit='s')
+        return df_prices
+
+    def close(self):
+        self.connection.close()
+
+
+class ReportStore:
+    # Annonces déjà signalées comme expirées à Jinka, pour ne jamais les signaler deux fois
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS reports (
+                                       id TEXT PRIMARY KEY,
+                                       alert_id TEXT,
+                                       reason TEXT,
+                                       reported_at TEXT)''')
+        self.connection.commit()
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+
+    def reported_ids(self, ids):
+        reported = set()
+        for chunk in chunks(str(appart_id) for appart_id in ids):
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT id FROM reports WHERE id IN ({placeholders})', chunk)
+            reported.update(row[0] for row in rows)
+        return reported
+
+    def save_reports(self, reports, reason):
+        # reports : {id: alert_id}
+        reported_at = datetime.now().isoformat(timespec='seconds')
+        rows = [(str(appart_id), None if alert_id is None else str(alert_id), reason, reported_at)
+                for appart_id, alert_id in reports.items()]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO reports (id, alert_id, reason, reported_at) '
+                                        'VALUES (?, ?, ?, ?)', rows)
+
+    def close(self):
+        self.connection.close()
+
+
+def needs_full_sync(sync_state_path, interval):
+    synced_at = last_full_sync(sync_state_path)
+    if synced_at is None:
+        return True
+    return (datetime.now() - datetime.fromisoformat(synced_at)).total_seconds() > interval
+
+
+def last_full_sync(sync_state_path):
+    if not os.path.exists(sync_state_path):
+        return None
+    with open(sync_state_path, 'r') as f:
+        return json.load(f)['last_full_sync']
+
+
+def save_full_sync(sync_state_path, synced_at=None):
+    synced_at = datetime.now().isoformat(timespec='seconds') if synced_at is None else synced_at
+    with open(sync_state_path, 'w') as f:
+        json.dump({'last_full_sync': synced_at}, f)